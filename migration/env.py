@@ -32,6 +32,7 @@ from src.sql_app.model.User import *
 from src.sql_app.model.Recipe import *
 from src.sql_app.model.Video import *
 from src.sql_app.model.Model import *
+from src.sql_app.model.Job import *
 
 target_metadata = Base.metadata
 
@@ -0,0 +1,102 @@
+import functools
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from reloadable import Reloadable
+from sql_app.model.Recipe import Ingredient, SubIngredient
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))  # seconds, see ``Reloadable``
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    names: tuple[str, ...] = ()  # ordered by id
+    name_to_id: dict[str, int] = field(default_factory=dict)
+    ids: frozenset[int] = frozenset()
+    # lower case name and mandarin of the ingredients and of their sub-ingredients: iid
+    aliases: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def name_set(self) -> frozenset[str]:
+        return frozenset(self.name_to_id)
+
+    def iids_of(self, names: Iterable[str]) -> list[int]:
+        """
+        Ingredient ids of detected names, a sub-ingredient stands for its ingredient. Unknown names are skipped.
+        """
+        return list(dict.fromkeys(self.aliases[key] for key in (name.strip().lower() for name in names)
+                                  if key in self.aliases))
+
+
+class IngredientCatalog(Reloadable):
+    """
+    In-memory copy of the ``ingredient`` / ``sub_ingredient`` tables.
+
+    Readers get an immutable snapshot, so they never wait on each other. Every write endpoint calls
+    ``invalidate`` (or ``upsert_names``) which bumps the version, the next reader loads a new snapshot.
+    """
+
+    def __init__(self):
+        super().__init__(CATALOG_TTL)
+        self._snapshot: CatalogSnapshot | None = None
+
+    async def get(self, db: AsyncSession) -> CatalogSnapshot:
+        await self._ensure(functools.partial(self._load, db))
+        return self._snapshot
+
+    async def _load(self, db: AsyncSession, version: int):
+        ingredients = (await db.execute(select(Ingredient.id, Ingredient.name, Ingredient.mandarin)
+                                        .order_by(Ingredient.id))).all()
+        subs = (await db.execute(select(SubIngredient.iid, SubIngredient.name, SubIngredient.mandarin))).all()
+
+        # sub-ingredients first, an ingredient's own names win over a sub-ingredient with the same name
+        entries = [(row.iid, row.name, row.mandarin) for row in subs]
+        entries += [(row.id, row.name, row.mandarin) for row in ingredients]
+        aliases = {}
+        for iid, name, mandarin in entries:
+            for alias in (name, mandarin):
+                if alias:
+                    aliases[alias.strip().lower()] = iid
+
+        logger.debug(f"load ingredient catalog version {version} ({len(ingredients)} ingredients)")
+        self._snapshot = CatalogSnapshot(
+            version=version,
+            names=tuple(row.name for row in ingredients),
+            name_to_id={row.name: row.id for row in ingredients},
+            ids=frozenset(row.id for row in ingredients),
+            aliases=aliases,
+        )
+
+    async def upsert_names(self, db: AsyncSession, names: Iterable[str], mandarin: str = "還沒有翻譯") -> list[str]:
+        """
+        Insert the names which are not ingredients yet, in one statement and one commit.
+
+        :return: the inserted names
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+
+        existing = set((await db.execute(select(Ingredient.name).where(Ingredient.name.in_(names)))).scalars())
+        new_names = [name for name in names if name not in existing]
+        if new_names:
+            try:
+                await db.execute(insert(Ingredient), [{'name': name, 'mandarin': mandarin} for name in new_names])
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                raise e
+            self.invalidate()
+
+        return new_names
+
+
+catalog = IngredientCatalog()
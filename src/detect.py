@@ -1,7 +1,6 @@
 import asyncio
 import concurrent.futures
-import copy
-import io
+import hashlib
 import json
 import logging
 import os
@@ -9,145 +8,141 @@ import uuid
 from datetime import datetime
 from typing import List
 
-import PIL
-import aiofiles
-import cv2
-import ffmpeg
 import google.generativeai as genai
-import numpy as np
-import aiohttp
-from PIL import Image, ImageDraw
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
 from google.ai.generativelanguage_v1beta.types import content
-from sahi import AutoDetectionModel
-from sahi.predict import get_sliced_prediction
 from sqlalchemy import select, update, delete
 from starlette.concurrency import run_in_threadpool
 from ultralytics import YOLO
 
+from inference.backend import resolve_device, export_model, remove_artifacts, max_batch, predict_batches
+from inference.batching import MicroBatcher
+from inference.cache import DetectionCache, detection_key
+from inference.gemini import GeminiFiles
+from inference.jobs import VideoJobQueue
+from inference.postprocess import confidence_filter, class_thresholds, from_boxes, group_by_class, confident_classes
+from inference.registry import ModelSpec, init_worker, get_model, new_generation, bump_generation
+from inference.slicing import Prediction, sliced_prediction, decode_image, SLICE_BATCH_SIZE
+from inference.render import save_source, register_render, render_path
 from sql_app.db import AsyncDBSession
+from sql_app.model.Job import VideoJob
 from sql_app.model.Model import Model
-from sql_app.model.Recipe import Ingredient
 from sql_app.model.User import User
+from response.detect import DetectionResponse, VideoJobCreated, VideoJobResponse
+from upload import save_upload, read_upload, VIDEO_UPLOAD_LIMIT, MODEL_UPLOAD_LIMIT, GEMINI_UPLOAD_LIMIT
+from catalog import catalog
 from user import token_verify
 
 detection_router = APIRouter(prefix="/detect", tags=['detect'])
-limit = 0.2  # seconds
 
 logger = logging.getLogger(__name__)
 
-detect_process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)
-
-# each ingredient's confidence threshold
-confidence_filter = {"mushroom": 0.85, "okra": 0.75, "heim": 0.85, "beef": 0.4, "chicken": 0.4, "pork": 0.4,
-                     "noodle": 0.85, "carrot": 0.5, "common": 0.65  # the ingridient which is not in the filter
-                     }
-
-
-def result_processing(img, results):  # results:[{"key":[(x1,x2,y1,y2)]}]
-    path = {}
+# bumped on every model upload/delete, so the workers drop the models they have loaded
+model_generation = new_generation()
+# every worker holds its own models
+DETECT_WORKERS = int(os.getenv("DETECT_WORKERS", "2"))
+detect_process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=DETECT_WORKERS, initializer=init_worker,
+                                                             initargs=(model_generation,))
+# videos get their own workers, a long video never holds up the image requests.
+# more workers means more segments of a video detected at once
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", "2"))
+video_process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=VIDEO_WORKERS, initializer=init_worker,
+                                                            initargs=(model_generation,))
+
+# videos are detected in the background, the clients poll the job
+video_jobs = VideoJobQueue(video_process_pool, VIDEO_WORKERS)
+
+# repeated uploads of the same image are answered without running the model again
+detection_cache = DetectionCache()
+
+
+def result_processing(contents, digest, results, width=4):  # results:{"key":[(x1,y1,x2,y2)]}
+    # nothing is drawn here, the annotated images are rendered when they are requested
+    source = save_source(contents, digest)
+    response = {}
     for key, points in results.items():
-        img_cp = img.copy()
-        img_draw = ImageDraw.Draw(img_cp)
-        random_name = f"img/{uuid.uuid4().hex}.jpg"
-        for point in points:
-            x1, x2, y1, y2 = point
-            img_draw.rectangle([(x1, y1), (x2, y2)], outline="red", width=3)
-        path[key] = random_name
-        img_cp.save(random_name)
-    return path
-
-
-def image_processing(image, model_path):
-    model = AutoDetectionModel.from_pretrained(model_type="yolov8", device="cuda:0", model_path=model_path, )
-    results = get_sliced_prediction(image, model, slice_height=500, slice_width=500, overlap_height_ratio=0.2,
-                                    overlap_width_ratio=0.2)
-    result = {}
-
-    print("%-5s %-20s %-15s %s %s" % ("index", "name", "confidence", "status", "threshold"))
-
-    for idx, det in enumerate(results.object_prediction_list):
-
-        show_log = lambda status, th: print(
-            "%-5d %-20s %.13f %-6s %s" % (idx, det.category.name, det.score.value, status, th))
-
-        if det.category.name not in confidence_filter:
-            threshold = confidence_filter['common']
-        else:
-            threshold = confidence_filter[det.category.name]
+        render_id = register_render(source, points, width)
+        response[key] = DetectionResponse(render_id=render_id, path=render_path(render_id), boxes=points).dict()
+    return response
 
-        if det.score.value < threshold:
-            show_log("ignore", threshold)
-            continue
 
-        show_log("keep", threshold)
+def image_processing(prediction: Prediction, names):
+    result = group_by_class(*prediction, class_thresholds(names, confidence_filter), names)
+    logger.debug(f"keep {sum(len(x) for x in result.values())} of {len(prediction.conf)} detections")
+    return result
 
-        if det.category.name not in result:
-            result[det.category.name] = []
-        result[det.category.name].append([det.bbox.minx, det.bbox.maxx, det.bbox.miny, det.bbox.maxy])
 
-    return result
+def image_batch_processing(images, spec: ModelSpec):  # return [{"name":[(x1,y1,x2,y2)]}] for each image
+    model = get_model(spec)
+    # small images get one full frame pass, the slices of the large ones are batched into the same forward calls
+    predictions = sliced_prediction(model, images, resolve_device(), batch_size=max_batch(spec, SLICE_BATCH_SIZE))
+    return [image_processing(prediction, model.names) for prediction in predictions]
 
 
 @detection_router.post("/latest/img")
-async def detect_image(db: AsyncDBSession, image: UploadFile = File(...)) -> dict[str, str]:
+async def detect_image(db: AsyncDBSession, image: UploadFile = File(...)) -> dict[str, DetectionResponse]:
     stmt = select(Model).order_by(Model.update_date.desc()).limit(1)
     result = (await db.execute(stmt)).scalars().first()
 
+    if not result:
+        raise HTTPException(status_code=404, detail='Model not found')
+    spec = ModelSpec.from_row(result)
+
     contents = await image.read()
-    img = PIL.Image.open(io.BytesIO(contents))
-    img_np = np.array(img)
-    # img_np = img_np[:, :, ::-1]
+    digest = hashlib.sha256(contents).hexdigest()
+    key = detection_key(digest, spec, 'sliced')
+    cached = await detection_cache.get(key)
+    if cached is not None:
+        return cached
+
+    img_np = await run_in_threadpool(decode_image, contents)
 
-    loop = asyncio.get_event_loop()
     time_old = datetime.now()
-    det_result = await loop.run_in_executor(detect_process_pool, image_processing, img_np, result.file_path)
+    det_result = await sliced_batcher.submit(spec, img_np)
     print(f"take {datetime.now() - time_old} to detect image")
-    result = await loop.run_in_executor(detect_process_pool, result_processing, img, det_result)
+    result = await run_in_threadpool(result_processing, contents, digest, det_result, 3)
+    await detection_cache.put(key, result)
 
     return result
 
 
+def yolo_batch_processing(images, spec: ModelSpec):  # return [{"name":[(x1,y1,x2,y2)]}] for each image
+    model = get_model(spec)
+    # one forward pass for the whole batch
+    results = predict_batches(model, list(images), max_batch(spec, len(images)), verbose=False, device=resolve_device())
+
+    thresholds = class_thresholds(model.names)
+    return [group_by_class(*from_boxes(i.boxes), thresholds, model.names) for i in results]
+
+
+# concurrent image requests for the same model are merged into one job for the detection workers
+sliced_batcher = MicroBatcher(detect_process_pool, image_batch_processing)
+yolo_batcher = MicroBatcher(detect_process_pool, yolo_batch_processing)
+
+
 @detection_router.post("/{version}/img")
-async def detect_image(version: str, db: AsyncDBSession, image: UploadFile = File(...)):
+async def detect_image(version: str, db: AsyncDBSession, image: UploadFile = File(...)) -> dict[str, DetectionResponse]:
     stmt = select(Model).where(Model.version == version).order_by(Model.update_date.desc()).limit(1)
     result = (await db.execute(stmt)).scalars().first()
 
     if not result:
         raise HTTPException(status_code=404, detail='Model not found')
-    model = YOLO(result.file_path)
+    spec = ModelSpec.from_row(result)
 
     contents = await image.read()
-    img = PIL.Image.open(io.BytesIO(contents))
-    img_np = np.array(img)
-
-    result = await run_in_threadpool(model, img_np, 0.5)
+    digest = hashlib.sha256(contents).hexdigest()
+    key = detection_key(digest, spec, 'yolo')
+    cached = await detection_cache.get(key)
+    if cached is not None:
+        return cached
 
-    temp = {}
+    img_np = await run_in_threadpool(decode_image, contents)
 
-    print(model.names)
+    boxes = await yolo_batcher.submit(spec, img_np)
+    result = await run_in_threadpool(result_processing, contents, digest, boxes)
+    await detection_cache.put(key, result)
 
-    for i in result:
-        print(i.plot())  # show image!
-        for j in i.boxes:
-            index = int(j.cls)
-            name = model.names[index]
-            conf = j.conf[0]
-
-            if conf > 0.5:
-                if name not in temp:
-                    temp[name] = []
-                x1, y1, x2, y2 = j.xyxy[0]
-                img_copy = img.copy()
-                img_draw = ImageDraw.Draw(img_copy)
-                img_draw.rectangle([(x1, y1), (x2, y2)], outline='red', width=4)
-
-                random_name = uuid.uuid4().hex
-                img_copy.save(f"img/{random_name}.jpg")
-
-                temp[name].append(f"img/{random_name}.jpg")
-
-    return list(temp.keys())
+    return result
 
 
 @detection_router.post("/upload/pt")
@@ -166,10 +161,11 @@ async def upload_pt(db: AsyncDBSession, description: str, version: str, user: Us
         raise HTTPException(status_code=400, detail='Not supported file type')
 
     filename = f"pt/{uuid.uuid4().hex}.{extension}"
-    async with aiofiles.open(filename, 'wb') as output_file:
-        content = await pt.read()
-        size = len(content)
-        await output_file.write(content)
+    size, _ = await save_upload(pt, filename, MODEL_UPLOAD_LIMIT)
+
+    # ONNX / OpenVINO artifacts for the CPU nodes
+    loop = asyncio.get_event_loop()
+    artifacts = await loop.run_in_executor(detect_process_pool, export_model, filename)
 
     # info = {
     #     'description': 'No description',
@@ -182,9 +178,10 @@ async def upload_pt(db: AsyncDBSession, description: str, version: str, user: Us
     if result:
         path: str = result.file_path
         os.remove(path)
+        remove_artifacts(result.onnx_path, result.openvino_path)
         stmt = (
             update(Model).where(Model.version == version).values(file_path=filename, description=description, size=size,
-                                                                 update_date=datetime.now()))
+                                                                 update_date=datetime.now(), **artifacts))
         try:
             await db.execute(stmt)
             await db.commit()
@@ -194,7 +191,7 @@ async def upload_pt(db: AsyncDBSession, description: str, version: str, user: Us
 
     else:
         model_information = Model(file_path=filename, description=description, size=size, version=version,
-                                  update_date=datetime.now())
+                                  update_date=datetime.now(), **artifacts)
 
         try:
             db.add(model_information)
@@ -204,20 +201,11 @@ async def upload_pt(db: AsyncDBSession, description: str, version: str, user: Us
             await db.rollback()
             raise e
 
-    model = YOLO(filename)
+    bump_generation(model_generation)
 
-    for _, j in model.names.items():
-        stmt = select(Ingredient).where(Ingredient.name == j)
-        result = (await db.execute(stmt)).scalars().first()
-        if not result:
-            try:
-                igr = Ingredient(name=j, mandarin="還沒有翻譯")
-                db.add(igr)
-                await db.commit()
-                await db.refresh(igr)
-            except Exception as e:
-                await db.rollback()
-                raise e
+    model = YOLO(filename)
+    await catalog.upsert_names(db, model.names.values())
+    catalog.invalidate()
 
     return {'message': 'Register success'}
 
@@ -242,6 +230,7 @@ async def delete_version(version: str, db: AsyncDBSession, user: User = Depends(
 
     path = result.file_path
     os.remove(path)
+    remove_artifacts(result.onnx_path, result.openvino_path)
 
     stmt = select(Model).where(Model.version == version)
     result = (await db.execute(stmt)).scalars().first()
@@ -258,149 +247,105 @@ async def delete_version(version: str, db: AsyncDBSession, user: User = Depends(
         await db.rollback()
         raise e
 
-    return {'message': 'Delete success'}
-
-
-def video_processing(model, filename):
-    ffmpeg.input(f"{filename}").filter('fps', fps=30).filter('scale', height='1080', width='-2').output(
-        f"{filename}-convert.mp4").run()
-
-    cap = cv2.VideoCapture(f"{filename}-convert.mp4")
-    framerate = cap.get(cv2.CAP_PROP_FPS)
-
-    result = {}
-    continue_detect = {}
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        results = model(frame, 0.3, verbose=False)
-
-        detect_obj = {}
-        for i in results:
-            for j in i.boxes:
-                conf = j.conf[0]
-                if conf > 0.5:
-                    index = int(j.cls)
-                    name = model.names[index]
-                    pos = j.xyxy[0]
-                    if name not in detect_obj:
-                        detect_obj[name] = []
-                    detect_obj[name].append(pos)
-
-        del_list = []
-
-        for key in continue_detect.keys():
-            if key not in detect_obj:  # not continue detected the object so remove from it.
-                del_list.append(key)
-
-        for i in del_list:
-            del continue_detect[i]
-
-        for key in detect_obj.keys():
-            if key not in continue_detect:
-                continue_detect[key] = 0
-            else:
-                continue_detect[key] = continue_detect[key] + 1
-
-        for key, value in continue_detect.items():
-            if value == int(framerate * limit):
-                if key not in result:
-                    result[key] = []
-                random_name = f"img/{uuid.uuid4().hex}.jpg"
-
-                result[key].append(random_name)
-
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-                img = Image.fromarray(frame.astype('uint8'))
-                img_draw = ImageDraw.Draw(img)
-
-                for x1, y1, x2, y2 in detect_obj[key]:
-                    img_draw.rectangle([(x1, y1), (x2, y2)], outline='red', width=4)
-                img.save(random_name)
+    bump_generation(model_generation)
+    catalog.invalidate()
 
-    os.remove(filename)
-    # os.remove(f"{filename}-convert.mp4")
-    return result
+    return {'message': 'Delete success'}
 
 
 # only support mp4 file
 @detection_router.post('/latest/video')
-async def detect_video(db: AsyncDBSession, video: UploadFile = File(...)):
+async def detect_video(db: AsyncDBSession, video: UploadFile = File(...)) -> VideoJobCreated:
     stmt = select(Model).order_by(Model.update_date.desc()).limit(1)
     result = (await db.execute(stmt)).scalars().first()
-    model = YOLO(result.file_path, task='detect')
 
-    contents = await video.read()
+    if not result:
+        raise HTTPException(status_code=404, detail='Model not found')
 
+    video_jobs.check_capacity()
     filename = f"temp/{uuid.uuid4().hex}"
+    size, digest = await save_upload(video, filename, VIDEO_UPLOAD_LIMIT)
+    logger.info(f"receive video {digest} ({size} bytes)")
 
-    async with aiofiles.open(filename, 'wb') as output_file:
-        await output_file.write(contents)
-
-    time_old = datetime.now()
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(detect_process_pool, video_processing, model, filename)
-    logger.info(f"take {datetime.now() - time_old} to detect video")
-
-    return result
+    job_id = await video_jobs.submit(db, result.version, filename)
+    return {'job_id': job_id}
 
 
 @detection_router.post('/{version}/video')
-async def detect_video(version: str, db: AsyncDBSession, video: UploadFile = File(...)):
+async def detect_video(version: str, db: AsyncDBSession, video: UploadFile = File(...)) -> VideoJobCreated:
     stmt = select(Model).where(Model.version == version).order_by(Model.update_date.desc()).limit(1)
     result = (await db.execute(stmt)).scalars().first()
-    model = YOLO(result.file_path, task='detect')
 
-    contents = await video.read()
+    if not result:
+        raise HTTPException(status_code=404, detail='Model not found')
 
+    video_jobs.check_capacity()
     filename = f"temp/{uuid.uuid4().hex}.mp4"
+    size, digest = await save_upload(video, filename, VIDEO_UPLOAD_LIMIT)
+    logger.info(f"receive video {digest} ({size} bytes)")
 
-    async with aiofiles.open(filename, 'wb') as output_file:
-        await output_file.write(contents)
+    job_id = await video_jobs.submit(db, version, filename)
+    return {'job_id': job_id}
 
-    time_old = datetime.now()
-    result = await run_in_threadpool(video_processing, model, filename)
-    logger.info(f"Take {datetime.now() - time_old} to detect video")
-    return result
+
+@detection_router.get('/video/job/{job_id}')
+async def video_job_status(job_id: str, db: AsyncDBSession) -> VideoJobResponse:
+    stmt = select(VideoJob).where(VideoJob.id == job_id)
+    job = (await db.execute(stmt)).scalars().first()
+
+    if not job:
+        raise HTTPException(status_code=404, detail='Job not found')
+
+    return {'id': job.id, 'version': job.version, 'state': job.state, 'frames_done': job.frames_done,
+            'frames_total': job.frames_total, 'error': job.error}
+
+
+@detection_router.get('/video/job/{job_id}/result')
+async def video_job_result(job_id: str, db: AsyncDBSession) -> dict[str, List[str]]:
+    stmt = select(VideoJob).where(VideoJob.id == job_id)
+    job = (await db.execute(stmt)).scalars().first()
+
+    if not job:
+        raise HTTPException(status_code=404, detail='Job not found')
+    if job.state != 'done':
+        raise HTTPException(status_code=409, detail=f'Job is {job.state}')
+
+    return job.result
 
 
 # The code to implement the
 
 # GOOGLE API KEY
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-BASE_URL = "https://generativelanguage.googleapis.com"
 
 genai.configure(api_key=GOOGLE_API_KEY)
 
-chat_session = None
-list_of_i = []
-ingredients_set = set()
-lock = asyncio.Lock()
+# one pooled client for every upload, images sent before are not uploaded again
+gemini_files = GeminiFiles(GOOGLE_API_KEY)
 
+# at most this many requests are waiting on gemini at once
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "16"))
+gemini_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
 
-# If ingredients change, server will need to restart to update the chat session
-async def get_chat_session(db:AsyncDBSession):
+# catalog version -> (model, history), every request starts its own chat from the template
+chat_templates = {}
 
-    async with lock:
-        global chat_session, list_of_i, ingredients_set
 
-        result = await db.execute(select(Ingredient.name))
-        ingredients = [i.name for i in result]
+# The template is rebuilt when the ingredient catalog changes
+async def get_chat_session(db:AsyncDBSession):
+    snapshot = await catalog.get(db)
 
-        if list_of_i != ingredients:
-            chat_session = None  # reset chat session
-            list_of_i = ingredients
-            ingredients_set = set(ingredients)
-        if chat_session is None:
-            await run_in_threadpool(init_session, ingredients)
-        return copy.deepcopy(chat_session)
+    template = chat_templates.get(snapshot.version)
+    if template is None:  # building it twice on a race is harmless
+        template = init_session(list(snapshot.names))
+        chat_templates.clear()  # sessions of older catalogs are never asked for again
+        chat_templates[snapshot.version] = template
 
+    model, history = template
+    return model.start_chat(history=list(history)), snapshot.name_set
 
-def init_session(ingredients):
-    global chat_session
 
+def init_session(ingredients):
     generation_config = {
         "temperature": 1,
         "top_p": 0.95,
@@ -424,78 +369,12 @@ def init_session(ingredients):
         ],
     }]
 
-    chat_session = model.start_chat(history=history)
+    return model, history
 
 
-# This function only supports .jpg or .png files,
-# and if the file is not a .jpg or .png file, it will
-async def upload2gemini(path):
-    # Using Pillow to check if the file is a .jpg or .png file
-    try:
-        with PIL.Image.open(path) as img:
-            if img.format not in ['JPEG', 'PNG']:
-                raise HTTPException(status_code=415, detail='This endpoint only support jpg or png file')
-    except PIL.UnidentifiedImageError:
-        raise HTTPException(status_code=415, detail='We can\'t recognize the file type')
-
-    size_of_file = os.path.getsize(path)
-
-    headers = {
-        'X-Goog-Upload-Protocol': 'resumable',
-        'X-Goog-Upload-Command': 'start',
-        'Content-Type': 'application/json',
-        'X-Goog-Upload-Header-Content-Length': str(size_of_file) # header only support str, not int
-    }
-
-    params = {'key': GOOGLE_API_KEY}
-
-    filename = os.path.basename(path)
-
-    data = "{'file': {'display_name': '" + filename + "'}}"
-
-    # response = requests.post(f'{BASE_URL}/upload/v1beta/files', params=params, headers=headers, data=data)
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f'{BASE_URL}/upload/v1beta/files', params=params, headers=headers, data=data) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=response.status_code,
-                                    detail="Error when upload image to gemini server. details: " + str(await response.json()))
-
-        upload_url = response.headers["x-goog-upload-url"]
-
-        headers = {
-            'X-Goog-Upload-Offset': '0',
-            'X-Goog-Upload-Command': 'upload, finalize',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-
-        async with aiofiles.open(path, 'rb') as file:
-            data = await file.read()
-
-        # res = requests.post(f'{upload_url}', headers=headers, data=data).json()['file']
-        async with session.post(f'{upload_url}', headers=headers, data=data) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=response.status_code,
-                                    detail="Error when upload image to gemini server. details: " + str(await response.json()))
-            res = (await response.json())['file']
-
-        args = {
-            'name': res['name'],
-            'display_name': res['displayName'],
-            'mime_type': res['mimeType'],
-            'sha256_hash': res['sha256Hash'],
-            'size_bytes': res['sizeBytes'],
-            'state': res['state'],
-            'uri': res['uri'],
-            'create_time': res['createTime'],
-            'expiration_time': res['expirationTime'],
-            'update_time': res['updateTime']
-        }
-    
-        return genai.types.File(args)
-
-
-def detect_files(session, file):
-    response = session.send_message(file)
+async def detect_files(session, file, ingredients_set):
+    async with gemini_semaphore:
+        response = await session.send_message_async(file)
     output = json.loads(response.text)
     result = []
 
@@ -504,33 +383,86 @@ def detect_files(session, file):
         if i in ingredients_set:
             result.append(i)
         else:
-            print(f"Warning: {i} is not in the list of ingredients.")
+            logger.warning(f"{i} is not in the list of ingredients.")
 
     return result
 
 
-
-
 @detection_router.post("/gemini")
-async def detect_by_gemini(background:BackgroundTasks,session = Depends(get_chat_session),files: List[UploadFile] = File(...)) -> List[str]:
+async def detect_by_gemini(chat = Depends(get_chat_session),files: List[UploadFile] = File(...)) -> List[str]:
     """
     Detect the ingredients in the image by using the gemini API
 
     :param files: List of images
     """
 
+    session, ingredients_set = chat
     upload_coroutine = []
 
     for file in files:
-        random_name = uuid.uuid4().hex
-        async with aiofiles.open(f"./img/{random_name}", 'wb') as output_file:
-            await output_file.write(await file.read())
-        upload_coroutine.append(upload2gemini(f"./img/{random_name}"))
+        data, digest = await read_upload(file, GEMINI_UPLOAD_LIMIT)
+        upload_coroutine.append(gemini_files.upload(data, digest, digest))
 
+    # the uploaded files are kept for reuse, gemini deletes them when they expire
     upload_files = await asyncio.gather(*upload_coroutine)
 
-    response = await run_in_threadpool(detect_files, session, upload_files)
-    for i in upload_files:
-        background.add_task(run_in_threadpool,i.delete)
+    response = await detect_files(session, upload_files, ingredients_set)
 
     return response
+
+
+# detections under this confidence are noise, between it and the class threshold the image goes to gemini
+CASCADE_MIN_CONF = float(os.getenv("CASCADE_MIN_CONF", "0.25"))
+
+
+def cascade_batch_processing(images, spec: ModelSpec):  # return [(["name"], uncertain)] for each image
+    model = get_model(spec)
+    results = predict_batches(model, list(images), max_batch(spec, len(images)), verbose=False, device=resolve_device(),
+                              conf=CASCADE_MIN_CONF)
+
+    thresholds = class_thresholds(model.names, confidence_filter)
+    output = []
+    for i in results:
+        _, conf, cls = from_boxes(i.boxes)
+        classes, uncertain = confident_classes(conf, cls, thresholds, CASCADE_MIN_CONF)
+        output.append(([model.names[c] for c in classes], uncertain))
+    return output
+
+
+cascade_batcher = MicroBatcher(detect_process_pool, cascade_batch_processing)
+
+
+@detection_router.post("/cascade")
+async def detect_by_cascade(db: AsyncDBSession, files: List[UploadFile] = File(...)) -> List[str]:
+    """
+    Detect the ingredients with the latest local model first,
+    only the images it is not confident about are sent to the gemini API
+
+    :param files: List of images
+    """
+
+    stmt = select(Model).order_by(Model.update_date.desc()).limit(1)
+    result = (await db.execute(stmt)).scalars().first()
+    spec = ModelSpec.from_row(result) if result else None
+
+    uploads = [await read_upload(file, GEMINI_UPLOAD_LIMIT) for file in files]
+
+    detected = []
+    remote = []
+    if spec is None:  # no local model, everything goes to gemini
+        remote = uploads
+    else:
+        images = [await run_in_threadpool(decode_image, data) for data, _ in uploads]
+        local = await asyncio.gather(*[cascade_batcher.submit(spec, image) for image in images])
+        for upload, (names, uncertain) in zip(uploads, local):
+            detected.extend(names)
+            if uncertain:
+                remote.append(upload)
+
+    if remote:
+        session, ingredients_set = await get_chat_session(db)
+        upload_files = await asyncio.gather(*[gemini_files.upload(data, digest, digest) for data, digest in remote])
+        detected.extend(await detect_files(session, upload_files, ingredients_set))
+
+    logger.debug(f"cascade sent {len(remote)} of {len(uploads)} images to gemini")
+    return list(dict.fromkeys(detected))  # merged, without duplicates
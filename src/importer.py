@@ -0,0 +1,186 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+
+from fastapi import UploadFile
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from catalog import catalog
+from made import update_weights
+from request.recipe import RecipeImportRecord
+from search import ingredient_index, keyword_index
+from sql_app.model.Recipe import made, Recipe, RecipeType, RecipeStats
+from sql_app.model.User import User, author
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))  # records validated and committed together
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))  # failures listed in the response
+
+
+def _ndjson(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, f"invalid json: {e.msg}"
+
+
+def _csv(stream):
+    # columns: name, description, video_link, rtype, author, iids ("1;2;3")
+    reader = csv.DictReader(stream)
+    line = 1
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:  # the reader goes on with the next line
+            line = max(reader.line_num, line + 1)  # it is not always counted when the line fails
+            yield line, f"invalid csv: {e}"
+            continue
+        line = reader.line_num
+        yield line, row
+
+
+def _validation_detail(error: ValidationError) -> str:
+    return '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+
+def _next_chunk(records, size: int) -> list[tuple[int, RecipeImportRecord | str]]:
+    # runs in the threadpool: reading the spooled upload and parsing don't block the event loop
+    chunk = []
+    try:
+        for number, data in itertools.islice(records, size):
+            if isinstance(data, str):
+                chunk.append((number, data))
+                continue
+            try:
+                chunk.append((number, RecipeImportRecord.parse_obj(data)))
+            except ValidationError as e:
+                chunk.append((number, _validation_detail(e)))
+    except UnicodeDecodeError:
+        chunk.append((chunk[-1][0] + 1 if chunk else 0, "the file is not utf-8, the rest of it is skipped"))
+        chunk.append(None)  # end of the import
+    return chunk
+
+
+class RecipeImport:
+    """
+    Import of recipe records (NDJSON, or CSV with a header row) streamed from an upload.
+
+    Each chunk is validated against the recipe types, users and ingredients, then written with batched
+    inserts and committed on its own, a failing chunk doesn't undo the others. The weights of the
+    linked ingredients are recomputed once at the end.
+    """
+
+    def __init__(self, db: AsyncSession, uid: int):
+        self.db = db
+        self.uid = uid  # author of the records without one
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self._linked = {}  # rtype: {iid}, for the weight recompute
+        self._types = None
+
+    def _error(self, line: int, detail: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'detail': detail})
+
+    async def run(self, file: UploadFile, csv_format: bool) -> dict:
+        stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+        try:
+            records = _csv(stream) if csv_format else _ndjson(stream)
+            while chunk := await run_in_threadpool(_next_chunk, records, IMPORT_CHUNK_SIZE):
+                done = chunk[-1] is None
+                await self._write([item for item in chunk if item is not None])
+                if done:
+                    break
+        finally:
+            stream.detach()  # the upload closes its own file
+            # the committed chunks stay even when a later one raised, their weights and the indexes follow
+            await self._reweight()
+        logger.info(f"imported {self.imported} recipes, {self.failed} failed")
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+    async def _validate(self, chunk) -> list[tuple[int, RecipeImportRecord]]:
+        if self._types is None:
+            self._types = set((await self.db.execute(select(RecipeType.id))).scalars())
+        known_iids = (await catalog.get(self.db)).ids
+
+        uids = {record.author for _, record in chunk if not isinstance(record, str) and record.author is not None}
+        users = set((await self.db.execute(select(User.id).where(User.id.in_(uids)))).scalars()) if uids else set()
+
+        valid = []
+        for line, record in chunk:
+            if isinstance(record, str):
+                self._error(line, record)
+            elif record.rtype is not None and record.rtype not in self._types:
+                self._error(line, f"recipe type {record.rtype} does not exist")
+            elif record.author is not None and record.author not in users:
+                self._error(line, f"user {record.author} does not exist")
+            elif unknown := [iid for iid in record.iids if iid not in known_iids]:
+                self._error(line, f"ingredients {unknown} do not exist")
+            else:
+                record.iids = list(dict.fromkeys(record.iids))
+                valid.append((line, record))
+        return valid
+
+    async def _write(self, chunk):
+        valid = await self._validate(chunk)
+        if not valid:
+            return
+
+        recipes = [Recipe(name=record.name, description=record.description, video_link=record.video_link,
+                          rtype=record.rtype) for _, record in valid]
+        try:
+            self.db.add_all(recipes)
+            await self.db.flush()  # the recipe ids
+
+            await self.db.execute(author.insert(), [{'uid': record.author or self.uid, 'rid': recipe.id}
+                                                    for recipe, (_, record) in zip(recipes, valid)])
+            links = [{'rid': recipe.id, 'iid': iid, 'weight': 1.0}
+                     for recipe, (_, record) in zip(recipes, valid) for iid in record.iids]
+            if links:
+                await self.db.execute(made.insert(), links)
+            await self.db.execute(RecipeStats.__table__.insert(), [
+                {'rid': recipe.id, 'rating_sum': 0, 'rating_count': 0, 'ingredient_count': len(record.iids),
+                 'comment_count': 0}
+                for recipe, (_, record) in zip(recipes, valid)])
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            logger.warning(f"import chunk failed: {e}")
+            for line, _ in valid:
+                self._error(line, f"the chunk of this record could not be written: {e.__class__.__name__}")
+            return
+
+        self.imported += len(valid)
+        for _, record in valid:
+            self._linked.setdefault(record.rtype, set()).update(record.iids)
+
+    async def _reweight(self):
+        if not self._linked:
+            return
+
+        try:
+            for rtype, iids in self._linked.items():
+                if iids:
+                    await update_weights(self.db, rtype, sorted(iids))
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise e
+        finally:
+            # many recipes changed, rebuilding is cheaper than refreshing them one by one
+            ingredient_index.invalidate()
+            keyword_index.invalidate()
@@ -0,0 +1,91 @@
+import functools
+import importlib.util
+import logging
+import os
+import shutil
+
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+# "auto" picks cuda:0 when there is a GPU, otherwise cpu
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+# OpenVINO export is slow and needs the openvino package, so it is opt-in
+EXPORT_OPENVINO = os.getenv("EXPORT_OPENVINO", "0") == "1"
+
+
+def _has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+@functools.cache
+def resolve_device() -> str:
+    if INFERENCE_DEVICE != "auto":
+        return INFERENCE_DEVICE
+
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+def select_weights(spec) -> str:
+    """
+    Choose the fastest artifact of a model for this host.
+
+    GPU hosts keep using the uploaded ``.pt`` / ``.engine``, CPU hosts prefer OpenVINO, then ONNX Runtime.
+    """
+    if resolve_device().startswith("cuda"):
+        return spec.file_path
+
+    if spec.openvino_path and os.path.exists(spec.openvino_path) and _has_module("openvino"):
+        return spec.openvino_path
+    if spec.onnx_path and os.path.exists(spec.onnx_path) and _has_module("onnxruntime"):
+        return spec.onnx_path
+    return spec.file_path
+
+
+def max_batch(spec, size: int) -> int:
+    """
+    Images sent to the model in one call. A TensorRT engine is built for a fixed batch size and rejects
+    larger batches, it gets them one by one.
+    """
+    return 1 if spec.file_path.endswith('.engine') else size
+
+
+def predict_batches(model, images: list, size: int, **kwargs) -> list:
+    results = []
+    for i in range(0, len(images), size):
+        results.extend(model(images[i:i + size], **kwargs))
+    return results
+
+
+def export_model(file_path: str) -> dict[str, str | None]:
+    """
+    Export an uploaded ``.pt`` to ONNX (and OpenVINO when enabled), the artifacts are written next to it.
+    A failed export is not fatal, the model is still usable through PyTorch.
+    """
+    artifacts = {'onnx_path': None, 'openvino_path': None}
+    if not file_path.endswith('.pt'):  # a TensorRT engine can't be exported
+        return artifacts
+
+    formats = [('onnx_path', 'onnx')]
+    if EXPORT_OPENVINO:
+        formats.append(('openvino_path', 'openvino'))
+
+    for field, fmt in formats:
+        try:
+            # dynamic axes, the images, slices and video frames are sent in batches
+            artifacts[field] = YOLO(file_path, task='detect').export(format=fmt, dynamic=True)
+        except Exception as e:
+            logger.warning(f"fail to export {file_path} to {fmt}: {e}")
+
+    return artifacts
+
+
+def remove_artifacts(*paths: str | None):
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):  # OpenVINO exports a directory
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
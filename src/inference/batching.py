@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+# a batch is sent to the workers when it is full or when its first request waited this long
+DETECT_BATCH_SIZE = int(os.getenv("DETECT_BATCH_SIZE", "8"))
+DETECT_BATCH_WAIT_MS = float(os.getenv("DETECT_BATCH_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Gather requests which target the same key (model) and run them as one call in ``executor``.
+
+    ``func(items, key)`` is executed in the executor and must return one result per item, in order.
+    Each caller of ``submit`` only gets its own result back. When a batch fails its items are run again
+    one by one, so a bad item only fails its own caller.
+    """
+
+    def __init__(self, executor, func: Callable, max_batch_size: int = DETECT_BATCH_SIZE,
+                 max_wait_ms: float = DETECT_BATCH_WAIT_MS):
+        self.executor = executor
+        self.func = func
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending: dict[Hashable, list] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+
+    async def submit(self, key: Hashable, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+
+        logger.debug(f"run batch of {len(batch)} for {key}")
+        self._run(key, batch)
+
+    def _run(self, key: Hashable, batch: list):
+        items = [item for item, _ in batch]
+        task = asyncio.get_running_loop().run_in_executor(self.executor, self.func, items, key)
+        task.add_done_callback(lambda t: self._deliver(t, key, batch))
+
+    def _deliver(self, task: asyncio.Future, key: Hashable, batch: list):
+        futures = [future for _, future in batch]
+        if task.cancelled():
+            for future in futures:
+                future.cancel()
+            return
+
+        exc = task.exception()
+        if exc is not None:
+            if len(batch) > 1:
+                logger.warning(f"batch of {len(batch)} for {key} failed, retry the items one by one: {exc}")
+                for entry in batch:
+                    if not entry[1].done():
+                        self._run(key, [entry])
+                return
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for future, result in zip(futures, task.result()):
+            if not future.done():  # the caller may have gone away
+                future.set_result(result)
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+DETECT_CACHE_SIZE = int(os.getenv("DETECT_CACHE_SIZE", "1024"))  # entries kept in memory
+DETECT_CACHE_DISK_SIZE = int(os.getenv("DETECT_CACHE_DISK_SIZE", "20000"))  # entries kept on disk
+DETECT_CACHE_DIR = os.getenv("DETECT_CACHE_DIR", "cache/detect")
+
+
+def detection_key(digest: str, spec, kind: str) -> str:
+    """
+    ``digest`` is the sha256 of the uploaded bytes, a re-uploaded model (new ``update_date``) never hits old results.
+    """
+    raw = f"{digest}:{spec.version}:{spec.update_date.isoformat()}:{kind}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class DetectionCache:
+    """
+    Two tier cache of detection responses: a LRU in memory in front of JSON files on disk.
+    Both tiers are bounded, the disk tier drops its oldest files first.
+    """
+
+    def __init__(self, directory: str = DETECT_CACHE_DIR, size: int = DETECT_CACHE_SIZE,
+                 disk_size: int = DETECT_CACHE_DISK_SIZE):
+        self.directory = directory
+        self.size = size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()
+        self._disk_count = None
+
+    def _path(self, key: str) -> str:
+        return f"{self.directory}/{key}.json"
+
+    async def get(self, key: str):
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            return value
+
+        value = await run_in_threadpool(self._read, key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    async def put(self, key: str, value):
+        self._remember(key, value)
+        await run_in_threadpool(self._write, key, value)
+
+    def _remember(self, key: str, value):
+        if self.size <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: str):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, key: str, value):
+        if self.disk_size <= 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._disk_count is None:
+            self._disk_count = len(os.listdir(self.directory))
+
+        temp = f"{self.directory}/{key}.{uuid.uuid4().hex}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp, self._path(key))
+        self._disk_count += 1
+
+        if self._disk_count > self.disk_size:
+            self._evict()
+
+    def _evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        keep = int(self.disk_size * 0.9)  # make some room, so we don't scan the directory on every write
+        for entry in entries[:max(0, len(entries) - keep)]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self._disk_count = min(len(entries), keep)
+        logger.debug(f"detection cache evicted down to {self._disk_count} entries")
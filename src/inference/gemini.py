@@ -0,0 +1,182 @@
+import asyncio
+import io
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import google.generativeai as genai
+from PIL import ExifTags, Image, ImageOps
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://generativelanguage.googleapis.com"
+
+GEMINI_FILE_CACHE_SIZE = int(os.getenv("GEMINI_FILE_CACHE_SIZE", "4096"))
+# a file is not handed out this close to its expiration, the chat may still be running when it expires
+GEMINI_FILE_MARGIN = timedelta(seconds=int(os.getenv("GEMINI_FILE_MARGIN", "600")))
+GEMINI_CONNECTIONS = int(os.getenv("GEMINI_CONNECTIONS", "32"))
+# the model gains nothing from more than ~2 MP, the images are shrunk before they are uploaded
+GEMINI_IMAGE_LONG_EDGE = int(os.getenv("GEMINI_IMAGE_LONG_EDGE", "1536"))
+GEMINI_JPEG_QUALITY = int(os.getenv("GEMINI_JPEG_QUALITY", "85"))
+
+_signatures = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+)
+
+
+def image_mime_type(data: bytes) -> str:
+    """
+    Only jpg and png are accepted, checked by the magic bytes so the image doesn't have to be decoded.
+    """
+    for signature, mime_type in _signatures:
+        if data.startswith(signature):
+            return mime_type
+    raise HTTPException(status_code=415, detail='This endpoint only support jpg or png file')
+
+
+def shrink_image(data: bytes, mime_type: str, long_edge: int = GEMINI_IMAGE_LONG_EDGE,
+                 quality: int = GEMINI_JPEG_QUALITY) -> tuple[bytes, str]:
+    """
+    Apply the EXIF orientation, downscale to ``long_edge`` and re-encode as JPEG.
+    A JPEG which is already small and upright is returned as it is.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+            if mime_type == 'image/jpeg' and orientation == 1 and max(img.size) <= long_edge:
+                return data, mime_type
+
+            img.draft('RGB', (long_edge, long_edge))  # let the JPEG decoder skip the resolution we throw away
+            image = ImageOps.exif_transpose(img).convert('RGB')
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(status_code=415, detail='We can\'t recognize the file type')
+
+    image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue(), 'image/jpeg'
+
+
+def _expiration(res) -> datetime:
+    try:
+        return datetime.fromisoformat(res['expirationTime'])
+    except (KeyError, ValueError):  # unknown expiration, don't reuse the file
+        return datetime.now(timezone.utc)
+
+
+async def _error(response):
+    try:
+        details = await response.json()
+    except (aiohttp.ContentTypeError, json.JSONDecodeError):
+        details = await response.text()
+    return HTTPException(status_code=response.status,
+                         detail="Error when upload image to gemini server. details: " + str(details))
+
+
+class GeminiFiles:
+    """
+    Uploads images to the Gemini file API through one pooled client session.
+    Uploaded files are remembered by the sha256 of their content until they expire,
+    so an image that was sent before is not uploaded again.
+    """
+
+    def __init__(self, api_key: str, size: int = GEMINI_FILE_CACHE_SIZE):
+        self.api_key = api_key
+        self.size = size
+        self._session = None
+        self._files = {}  # sha256 -> (File, expiration)
+        self._uploading = {}  # sha256 -> Task, the same image sent twice at once is uploaded once
+
+    def _client(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=GEMINI_CONNECTIONS))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _cached(self, digest: str):
+        entry = self._files.get(digest)
+        if entry is None:
+            return None
+        file, expiration = entry
+        if expiration - GEMINI_FILE_MARGIN <= datetime.now(timezone.utc):
+            del self._files[digest]
+            return None
+        return file
+
+    def _remember(self, digest: str, file, expiration: datetime):
+        if self.size <= 0:
+            return
+        self._files[digest] = (file, expiration)
+        if len(self._files) > self.size:
+            now = datetime.now(timezone.utc)
+            for key in [key for key, (_, exp) in self._files.items() if exp - GEMINI_FILE_MARGIN <= now]:
+                del self._files[key]
+            while len(self._files) > self.size:  # oldest uploads first
+                del self._files[next(iter(self._files))]
+
+    async def upload(self, data: bytes, digest: str, display_name: str):
+        file = self._cached(digest)
+        if file is not None:
+            return file
+
+        task = self._uploading.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(self._upload(data, digest, display_name))
+            self._uploading[digest] = task
+            task.add_done_callback(lambda _: self._uploading.pop(digest, None))
+        return await asyncio.shield(task)
+
+    async def _upload(self, data: bytes, digest: str, display_name: str):
+        # cached by the digest of the original bytes, the shrinking is done once per image
+        data, mime_type = await run_in_threadpool(shrink_image, data, image_mime_type(data))
+        session = self._client()
+        params = {'key': self.api_key}
+
+        headers = {
+            'X-Goog-Upload-Protocol': 'resumable',
+            'X-Goog-Upload-Command': 'start',
+            'X-Goog-Upload-Header-Content-Length': str(len(data)),  # header only support str, not int
+            'X-Goog-Upload-Header-Content-Type': mime_type,
+        }
+        async with session.post(f'{BASE_URL}/upload/v1beta/files', params=params, headers=headers,
+                                json={'file': {'display_name': display_name}}) as response:
+            if response.status != 200:
+                raise await _error(response)
+            upload_url = response.headers["x-goog-upload-url"]
+
+        headers = {
+            'X-Goog-Upload-Offset': '0',
+            'X-Goog-Upload-Command': 'upload, finalize',
+            'Content-Type': mime_type,
+        }
+        async with session.post(upload_url, headers=headers, data=data) as response:
+            if response.status != 200:
+                raise await _error(response)
+            res = (await response.json())['file']
+
+        args = {
+            'name': res['name'],
+            'display_name': res['displayName'],
+            'mime_type': res['mimeType'],
+            'sha256_hash': res['sha256Hash'],
+            'size_bytes': res['sizeBytes'],
+            'state': res['state'],
+            'uri': res['uri'],
+            'create_time': res['createTime'],
+            'expiration_time': res['expirationTime'],
+            'update_time': res['updateTime']
+        }
+        file = genai.types.File(args)
+
+        self._remember(digest, file, _expiration(res))
+        logger.debug(f"uploaded {display_name} to gemini as {res['name']}")
+        return file
@@ -0,0 +1,204 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from starlette.concurrency import run_in_threadpool
+
+from sql_app.db import async_session_factory
+from sql_app.model.Job import VideoJob
+from sql_app.model.Model import Model
+from .registry import ModelSpec
+from .video import video_processing, video_segment_processing, plan_segments, merge_segment_results
+
+logger = logging.getLogger(__name__)
+
+VIDEO_JOB_WORKERS = int(os.getenv("VIDEO_JOB_WORKERS", "2"))
+VIDEO_JOB_QUEUE_SIZE = int(os.getenv("VIDEO_JOB_QUEUE_SIZE", "100"))
+PROGRESS_INTERVAL = 1.0  # seconds between two progress writes
+
+
+class ProgressReporter:
+    """
+    Picklable progress callback for ``video_processing``, it writes into a dict shared through a manager.
+    """
+
+    def __init__(self, progress, job_id: str, segment: int = 0):
+        self.progress = progress
+        self.key = (job_id, segment)
+
+    def __call__(self, done: int, total: int):
+        self.progress[self.key] = (done, total)
+
+
+async def _set(job_id: str, **values):
+    async with async_session_factory() as db:
+        stmt = update(VideoJob).where(VideoJob.id == job_id).values(update_date=datetime.now(), **values)
+        try:
+            await db.execute(stmt)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+
+class VideoJobQueue:
+    """
+    Video detections run in the background, the state of every job is kept in the ``video_job`` table.
+    A fixed number of workers drain the queue, so only that many videos use ``executor`` at once.
+    Segments are handed to ``executor`` only when one of its ``slots`` is free, so the segments of a long
+    video don't pile up in the pool's queue ahead of everything else.
+    """
+
+    def __init__(self, executor, slots: int, workers: int = VIDEO_JOB_WORKERS, size: int = VIDEO_JOB_QUEUE_SIZE):
+        self.executor = executor
+        self.slots = slots
+        self.workers = workers
+        self.size = size
+        self._queue: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks = []
+        self._manager = None
+        self._progress = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.size)
+        self._slots = asyncio.Semaphore(self.slots)
+        self._manager = multiprocessing.Manager()
+        self._progress = self._manager.dict()
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._manager is not None:
+            self._manager.shutdown()
+
+    async def _recover(self):
+        # jobs which were queued or interrupted by a restart start over
+        async with async_session_factory() as db:
+            stmt = select(VideoJob.id).where(VideoJob.state.in_(['queued', 'running'])).order_by(VideoJob.create_date)
+            job_ids = (await db.execute(stmt)).scalars().all()
+
+        for job_id in job_ids:
+            if self._queue.full():
+                await _set(job_id, state='failed', error='Too many queued jobs')
+                continue
+            await _set(job_id, state='queued', frames_done=0)
+            self._queue.put_nowait(job_id)
+
+    def check_capacity(self):
+        # before the upload is saved, so a full queue doesn't cost a video written to disk
+        if self._queue is None or self._queue.full():
+            raise HTTPException(status_code=503, detail='Too many videos in the queue, try again later')
+
+    async def submit(self, db, version: str, filename: str) -> str:
+        """
+        Queue a job for the saved upload ``filename``, the file is removed when the job can't be queued.
+        """
+        try:
+            self.check_capacity()  # it may have filled up while the video was uploaded
+            job = VideoJob(id=uuid.uuid4().hex, version=version, file_path=filename, state='queued', frames_done=0,
+                           create_date=datetime.now(), update_date=datetime.now())
+            try:
+                db.add(job)
+                await db.commit()
+                await db.refresh(job)
+            except Exception as e:
+                await db.rollback()
+                raise e
+        except BaseException:
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+
+        self._queue.put_nowait(job.id)
+        return job.id
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception(f"video job {job_id} failed")
+                try:
+                    await _set(job_id, state='failed', error=str(e))
+                except Exception:  # the worker must keep serving the queue
+                    logger.exception(f"fail to mark video job {job_id} as failed")
+            finally:
+                for key in [key for key in self._progress.keys() if key[0] == job_id]:
+                    self._progress.pop(key, None)
+                self._queue.task_done()
+
+    async def _execute(self, func, *args):
+        async with self._slots:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def _job_progress(self, job_id: str) -> tuple[int, int]:
+        # summed over the segments of the job
+        done, total = 0, 0
+        for key, (frames_done, frames_total) in self._progress.items():
+            if key[0] == job_id:
+                done += frames_done
+                total += frames_total
+        return done, total
+
+    async def _run(self, job_id: str):
+        async with async_session_factory() as db:
+            job = (await db.execute(select(VideoJob).where(VideoJob.id == job_id))).scalars().first()
+            if job is None:
+                return
+            stmt = select(Model).where(Model.version == job.version).order_by(Model.update_date.desc()).limit(1)
+            model = (await db.execute(stmt)).scalars().first()
+            filename = job.file_path
+
+        try:
+            if model is None:
+                raise RuntimeError(f'Model {job.version} not found')
+
+            await _set(job_id, state='running')
+
+            time_old = datetime.now()
+            spec = ModelSpec.from_row(model)
+
+            # a long video is cut in segments which run on different workers at the same time
+            segments = await run_in_threadpool(plan_segments, filename)
+            if segments:
+                logger.info(f"split video of job {job_id} in {len(segments)} segments")
+                futures = [
+                    asyncio.ensure_future(self._execute(functools.partial(
+                        video_segment_processing, start=start, length=length,
+                        progress=ProgressReporter(self._progress, job_id, index)), spec, filename))
+                    for index, (start, length) in enumerate(segments)
+                ]
+            else:
+                futures = [asyncio.ensure_future(self._execute(functools.partial(
+                    video_processing, progress=ProgressReporter(self._progress, job_id)), spec, filename))]
+
+            pending = set(futures)
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=PROGRESS_INTERVAL)
+                if pending:
+                    frames_done, frames_total = self._job_progress(job_id)
+                    await _set(job_id, frames_done=frames_done, frames_total=frames_total)
+
+            if segments:
+                result = await run_in_threadpool(merge_segment_results, [future.result() for future in futures])
+            else:
+                result = futures[0].result()
+        finally:
+            if os.path.exists(filename):  # whatever happened to the job, video_processing only removes it on success
+                os.remove(filename)
+
+        frames_done, frames_total = self._job_progress(job_id)
+        await _set(job_id, state='done', result=result, frames_done=frames_done, frames_total=frames_total)
+        logger.info(f"take {datetime.now() - time_old} to detect video of job {job_id}")
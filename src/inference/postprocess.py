@@ -0,0 +1,69 @@
+import numpy as np
+
+# each ingredient's confidence threshold
+confidence_filter = {"mushroom": 0.85, "okra": 0.75, "heim": 0.85, "beef": 0.4, "chicken": 0.4, "pork": 0.4,
+                     "noodle": 0.85, "carrot": 0.5, "common": 0.65  # the ingridient which is not in the filter
+                     }
+
+_thresholds = {}
+
+
+def class_thresholds(names: dict[int, str], thresholds: dict[str, float] | None = None,
+                     default: float = 0.5) -> np.ndarray:
+    """
+    Threshold of every class index of a model, built once per ``names`` (which lives as long as the model).
+
+    :param thresholds: per name thresholds with a "common" fallback, every class gets ``default`` without it
+    """
+    key = (id(names), id(thresholds), default)
+    cached = _thresholds.get(key)
+    if cached is not None and cached[0] is names and cached[1] is thresholds:
+        return cached[2]
+
+    vector = np.full(max(names.keys(), default=-1) + 1, default, dtype=np.float32)
+    if thresholds is not None:
+        for index, name in names.items():
+            vector[index] = thresholds.get(name, thresholds['common'])
+
+    _thresholds[key] = (names, thresholds, vector)
+    return vector
+
+
+def from_boxes(boxes) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # ultralytics Boxes (tensors, maybe on GPU) to numpy arrays
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+
+def filter_detections(xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray,
+                      thresholds: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # keep the boxes over the threshold of their class
+    cls = np.asarray(cls, dtype=int)
+    keep = np.asarray(conf) >= thresholds[cls]
+    return np.asarray(xyxy)[keep], np.asarray(conf)[keep], cls[keep]
+
+
+def group_by_class(xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, thresholds: np.ndarray,
+                   names: dict[int, str]) -> dict[str, list]:  # return {"name":[(x1,y1,x2,y2)]}
+    """
+    Keep the boxes over the threshold of their class and group them by class name, in their original order.
+    """
+    xyxy, _, cls = filter_detections(xyxy, conf, cls, thresholds)
+    if len(cls) == 0:
+        return {}
+
+    order = np.argsort(cls, kind='stable')
+    classes, starts = np.unique(cls[order], return_index=True)
+    groups = np.split(xyxy[order].astype(float), starts[1:])
+    return {names[int(c)]: group.tolist() for c, group in zip(classes, groups)}
+
+
+def confident_classes(conf: np.ndarray, cls: np.ndarray, thresholds: np.ndarray,
+                      floor: float) -> tuple[list[int], bool]:
+    """
+    Classes with a detection over their threshold, and whether the image is uncertain:
+    nothing cleared its threshold, or something between ``floor`` and its threshold was seen.
+    """
+    conf, cls = np.asarray(conf), np.asarray(cls, dtype=int)
+    keep = conf >= thresholds[cls]
+    uncertain = not keep.any() or bool(np.any(~keep & (conf >= floor)))
+    return np.unique(cls[keep]).tolist(), uncertain
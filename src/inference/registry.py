@@ -0,0 +1,113 @@
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+from ultralytics import YOLO
+
+from .backend import resolve_device, select_weights
+
+logger = logging.getLogger(__name__)
+
+# how many loaded models each detection worker keeps around
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "2"))
+
+
+class ModelSpec(NamedTuple):
+    """
+    Everything a worker needs to find (or load) a model.
+
+    It is built from a ``Model`` row in the API process and sent to the workers instead of the model itself,
+    so a loaded model is never pickled across processes.
+    """
+    version: str
+    update_date: datetime
+    file_path: str
+    onnx_path: str | None = None
+    openvino_path: str | None = None
+
+    @classmethod
+    def from_row(cls, row) -> "ModelSpec":
+        return cls(version=row.version, update_date=row.update_date, file_path=row.file_path,
+                   onnx_path=row.onnx_path, openvino_path=row.openvino_path)
+
+
+def _load(spec: ModelSpec):
+    path = select_weights(spec)
+    logger.info(f"load model {spec.version} ({spec.update_date}) from {path} on {resolve_device()}")
+    return YOLO(path, task='detect')
+
+
+class ModelRegistry:
+    """
+    LRU of loaded models keyed by ``(version, update_date)``.
+
+    ``generation`` is a shared counter bumped by the API process when a model is uploaded or deleted,
+    a worker which sees a new value drops everything it has loaded.
+    """
+
+    def __init__(self, capacity: int = MODEL_CACHE_SIZE, generation=None):
+        self.capacity = max(1, capacity)
+        self._generation = generation
+        self._seen_generation = generation.value if generation is not None else 0
+        self._models = OrderedDict()
+
+    def _check_generation(self):
+        if self._generation is None:
+            return
+        current = self._generation.value
+        if current != self._seen_generation:
+            logger.info(f"model generation changed ({self._seen_generation} -> {current}), clear loaded models")
+            self._models.clear()
+            self._seen_generation = current
+
+    def get(self, spec: ModelSpec):
+        self._check_generation()
+
+        key = (spec.version, spec.update_date)
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+
+        # an older upload of the same version will never be asked again
+        for stale in [k for k in self._models if k[0] == spec.version and k[1] != spec.update_date]:
+            del self._models[stale]
+
+        model = _load(spec)
+        self._models[key] = model
+        while len(self._models) > self.capacity:
+            self._models.popitem(last=False)
+        return model
+
+    def clear(self):
+        self._models.clear()
+
+
+_registry: ModelRegistry | None = None
+
+
+def init_worker(generation, capacity: int = MODEL_CACHE_SIZE):
+    """
+    Initializer of the detection process pool, every worker gets its own registry.
+    """
+    global _registry
+    _registry = ModelRegistry(capacity, generation)
+
+
+def get_model(spec: ModelSpec):
+    global _registry
+    if _registry is None:  # called outside the pool (e.g. from a thread of the API process)
+        _registry = ModelRegistry()
+    return _registry.get(spec)
+
+
+def new_generation():
+    return multiprocessing.Value('i', 0)
+
+
+def bump_generation(generation):
+    with generation.get_lock():
+        generation.value += 1
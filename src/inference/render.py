@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+
+import anyio
+from PIL import Image, ImageDraw, ImageOps
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+# uploaded images and the boxes to draw on them, only ``img/`` is served to the clients
+RENDER_SOURCE_DIR = "render/source"
+RENDER_SPEC_DIR = "render/spec"
+
+render_name = re.compile(r"^([0-9a-f]{32})\.jpg$")
+
+
+def save_source(contents: bytes, digest: str | None = None) -> str:
+    """
+    Keep the uploaded bytes as they are (no decode / encode), the same image is only stored once.
+    """
+    os.makedirs(RENDER_SOURCE_DIR, exist_ok=True)
+    path = f"{RENDER_SOURCE_DIR}/{digest or hashlib.sha256(contents).hexdigest()}"
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(contents)
+    return path
+
+
+def register_render(source: str, boxes, width: int = 4) -> str:  # boxes:[(x1,y1,x2,y2)]
+    """
+    Remember what to draw, the image itself is only rendered when someone asks for ``img/{render_id}.jpg``.
+    """
+    os.makedirs(RENDER_SPEC_DIR, exist_ok=True)
+    render_id = uuid.uuid4().hex
+    with open(f"{RENDER_SPEC_DIR}/{render_id}.json", 'w') as f:
+        json.dump({"source": source, "boxes": [[float(x) for x in box] for box in boxes], "width": width}, f)
+    return render_id
+
+
+def render_path(render_id: str) -> str:
+    return f"img/{render_id}.jpg"
+
+
+def render(render_id: str, directory: str = "img") -> bool:
+    spec_path = f"{RENDER_SPEC_DIR}/{render_id}.json"
+    if not os.path.exists(spec_path):
+        return False
+
+    with open(spec_path) as f:
+        spec = json.load(f)
+
+    with Image.open(spec["source"]) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")  # upright, like the image the boxes were detected on
+    img_draw = ImageDraw.Draw(img)
+    for x1, y1, x2, y2 in spec["boxes"]:
+        img_draw.rectangle([(x1, y1), (x2, y2)], outline="red", width=spec["width"])
+
+    # two requests may render the same image at once, never serve a half written file
+    temp = f"{directory}/{render_id}.{uuid.uuid4().hex}.tmp"
+    img.save(temp, format="JPEG")
+    os.replace(temp, f"{directory}/{render_id}.jpg")
+    return True
+
+
+class RenderedFiles(StaticFiles):
+    """
+    ``StaticFiles`` which draws a registered render the first time it is requested,
+    after that the rendered file is served like any other static file.
+    """
+
+    async def get_response(self, path, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            match = render_name.match(os.path.basename(path))
+            if e.status_code != 404 or match is None or os.path.dirname(path):
+                raise e
+
+            if not await anyio.to_thread.run_sync(render, match.group(1), self.directory):
+                raise e
+            logger.debug(f"render {match.group(1)} on demand")
+            return await super().get_response(path, scope)
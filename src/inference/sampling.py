@@ -0,0 +1,48 @@
+import os
+
+import cv2
+import numpy as np
+
+# run the model on every n-th frame only
+VIDEO_FRAME_STRIDE = int(os.getenv("VIDEO_FRAME_STRIDE", "2"))
+# mean absolute difference (0-255) of the downscaled gray frames under which a frame counts as unchanged,
+# 0 disables the gate
+VIDEO_DIFF_THRESHOLD = float(os.getenv("VIDEO_DIFF_THRESHOLD", "3.0"))
+# run the model anyway after this many gated frames in a row, so a slow drift is never missed
+VIDEO_MAX_SKIP = int(os.getenv("VIDEO_MAX_SKIP", "10"))
+
+
+class FrameGate:
+    """
+    Cheap scene change test: compare a tiny gray thumbnail of the frame with the one of the last frame
+    that went through the model.
+    """
+
+    def __init__(self, threshold: float = VIDEO_DIFF_THRESHOLD, max_skip: int = VIDEO_MAX_SKIP,
+                 size: tuple[int, int] = (64, 36)):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.size = size
+        self.reference = None
+        self.skipped = 0
+
+    def need_inference(self, frame) -> bool:
+        if self.threshold <= 0:
+            return True
+
+        thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.size, interpolation=cv2.INTER_AREA)
+        if (self.reference is not None and self.skipped < self.max_skip
+                and np.mean(cv2.absdiff(thumb, self.reference)) < self.threshold):
+            self.skipped += 1
+            return False
+
+        self.reference = thumb
+        self.skipped = 0
+        return True
+
+
+def streak_threshold(framerate: float, stride: int, seconds: float) -> int:
+    """
+    The streak value at which an object has been seen for ``seconds``, counted in sampled frames.
+    """
+    return int(framerate / max(1, stride) * seconds)
@@ -0,0 +1,184 @@
+import io
+import os
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image, ImageOps
+from fastapi import HTTPException
+
+SLICE_SIZE = int(os.getenv("SLICE_SIZE", "500"))
+SLICE_OVERLAP = float(os.getenv("SLICE_OVERLAP", "0.2"))
+# images whose long edge is not larger than this only get a full frame pass
+SLICE_FULL_FRAME_MAX = int(os.getenv("SLICE_FULL_FRAME_MAX", "1280"))
+# run a low resolution pass first and only slice around what it found
+SLICE_COARSE = os.getenv("SLICE_COARSE", "0") == "1"
+SLICE_COARSE_CONF = float(os.getenv("SLICE_COARSE_CONF", "0.1"))
+# crops sent to the model in one call
+SLICE_BATCH_SIZE = int(os.getenv("SLICE_BATCH_SIZE", "32"))
+
+MODEL_CONF = 0.3  # same default as SAHI
+MERGE_IOS = 0.5  # boxes of the same class which overlap more than this (intersection over smaller) are merged
+
+
+class Prediction(NamedTuple):
+    boxes: np.ndarray  # (n, 4) x1, y1, x2, y2 in image coordinates
+    conf: np.ndarray  # (n,)
+    cls: np.ndarray  # (n,) int
+
+
+def _empty() -> Prediction:
+    return Prediction(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int))
+
+
+def to_bgr(image: np.ndarray) -> np.ndarray:
+    # PIL gives RGB / RGBA / gray arrays, the model wants BGR
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    return np.ascontiguousarray(image[:, :, 2::-1])
+
+
+def decode_image(contents: bytes) -> np.ndarray:
+    """
+    Uploaded bytes to the upright 3 channel BGR array the model wants, whatever the mode of the image.
+    """
+    try:
+        with Image.open(io.BytesIO(contents)) as img:
+            image = ImageOps.exif_transpose(img).convert('RGB')
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(status_code=415, detail='We can\'t recognize the file type')
+    return to_bgr(np.asarray(image))
+
+
+def slice_boxes(width: int, height: int, size: int = SLICE_SIZE, overlap: float = SLICE_OVERLAP) -> np.ndarray:
+    """
+    Same grid as SAHI: fixed size slices, the ones on the right / bottom edge are moved back inside the image.
+    """
+    step = max(1, int(size * (1 - overlap)))
+    slices = []
+    y = 0
+    while y < height:
+        y2 = min(height, y + size)
+        y1 = max(0, y2 - size)
+        x = 0
+        while x < width:
+            x2 = min(width, x + size)
+            x1 = max(0, x2 - size)
+            slices.append((x1, y1, x2, y2))
+            if x2 == width:
+                break
+            x += step
+        if y2 == height:
+            break
+        y += step
+    return np.array(slices, dtype=np.int64).reshape(-1, 4)
+
+
+def _predict(model, crops: list, device, batch_size: int) -> list[Prediction]:
+    predictions = []
+    for i in range(0, len(crops), batch_size):
+        for r in model(crops[i:i + batch_size], conf=MODEL_CONF, verbose=False, device=device):
+            boxes = r.boxes
+            predictions.append(Prediction(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(),
+                                          boxes.cls.cpu().numpy().astype(int)))
+    return predictions
+
+
+def _intersects(slices: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    # which slices overlap at least one box
+    if len(boxes) == 0:
+        return np.zeros(len(slices), dtype=bool)
+    x1 = np.maximum(slices[:, None, 0], boxes[None, :, 0])
+    y1 = np.maximum(slices[:, None, 1], boxes[None, :, 1])
+    x2 = np.minimum(slices[:, None, 2], boxes[None, :, 2])
+    y2 = np.minimum(slices[:, None, 3], boxes[None, :, 3])
+    return ((x2 > x1) & (y2 > y1)).any(axis=1)
+
+
+def merge(prediction: Prediction, ios: float = MERGE_IOS) -> Prediction:
+    """
+    Greedy non-maximum merging per class (like SAHI's GREEDYNMM): the best box absorbs every box of the same
+    class it overlaps, the merged box is their union and keeps the best confidence.
+    """
+    boxes, conf, cls = prediction
+    out_boxes, out_conf, out_cls = [], [], []
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    for c in np.unique(cls):
+        index = np.where(cls == c)[0]
+        index = index[np.argsort(-conf[index], kind='stable')]
+        while index.size:
+            best, rest = index[0], index[1:]
+            w = np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0])
+            h = np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1])
+            inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+            smaller = np.minimum(area[best], area[rest])
+            group = rest[inter > ios * np.maximum(smaller, 1e-9)]
+
+            members = np.concatenate([[best], group])
+            out_boxes.append([boxes[members, 0].min(), boxes[members, 1].min(),
+                              boxes[members, 2].max(), boxes[members, 3].max()])
+            out_conf.append(conf[best])
+            out_cls.append(c)
+            index = rest[~np.isin(rest, group)]
+
+    if not out_boxes:
+        return _empty()
+    return Prediction(np.array(out_boxes, dtype=np.float32), np.array(out_conf, dtype=np.float32),
+                      np.array(out_cls, dtype=int))
+
+
+def sliced_prediction(model, images: list, device, coarse: bool = SLICE_COARSE,
+                      batch_size: int = SLICE_BATCH_SIZE) -> list[Prediction]:
+    """
+    Predict a batch of BGR images.
+
+    A small image only gets a full frame pass. A large image gets a full frame pass plus one pass per slice
+    and all of them (of all the images) go through the model together, ``batch_size`` at a time. With
+    ``coarse`` the full frame pass runs first and only the slices which overlap one of its candidates are
+    run afterwards.
+    """
+    crops, owners, offsets = [], [], []
+
+    def add(index, crop, offset):
+        crops.append(crop)
+        owners.append(index)
+        offsets.append(offset)
+
+    grids = {}
+    for index, image in enumerate(images):
+        height, width = image.shape[:2]
+        add(index, image, (0, 0))
+        if max(width, height) > SLICE_FULL_FRAME_MAX:
+            grids[index] = slice_boxes(width, height)
+
+    if coarse and grids:
+        full = _predict(model, crops, device, batch_size)
+        crops, owners, offsets = [], [], []
+        for index, grid in grids.items():
+            candidates = full[index].boxes[full[index].conf >= SLICE_COARSE_CONF]
+            for x1, y1, x2, y2 in grid[_intersects(grid, candidates)]:
+                add(index, images[index][y1:y2, x1:x2], (x1, y1))
+        predictions = full + _predict(model, crops, device, batch_size)
+        owners = list(range(len(images))) + owners
+        offsets = [(0, 0)] * len(images) + offsets
+    else:
+        for index, grid in grids.items():
+            for x1, y1, x2, y2 in grid:
+                add(index, images[index][y1:y2, x1:x2], (x1, y1))
+        predictions = _predict(model, crops, device, batch_size)
+
+    per_image = [[] for _ in images]
+    for prediction, owner, (dx, dy) in zip(predictions, owners, offsets):
+        if len(prediction.boxes):
+            shift = np.array([dx, dy, dx, dy], dtype=np.float32)
+            per_image[owner].append(Prediction(prediction.boxes + shift, prediction.conf, prediction.cls))
+
+    results = []
+    for index, parts in enumerate(per_image):
+        if not parts:
+            results.append(_empty())
+            continue
+        prediction = Prediction(np.concatenate([p.boxes for p in parts]), np.concatenate([p.conf for p in parts]),
+                                np.concatenate([p.cls for p in parts]))
+        results.append(merge(prediction) if index in grids else prediction)
+    return results
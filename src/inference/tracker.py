@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+# sampled frames a track may go undetected before it is closed
+VIDEO_TRACK_GAP = int(os.getenv("VIDEO_TRACK_GAP", "5"))
+VIDEO_TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.3"))
+# a detection whose center is within this fraction of the track box diagonal also continues the track
+CENTROID_RATIO = 0.5
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:  # (n, 4) x (m, 4) -> (n, m)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match(a: np.ndarray, b: np.ndarray, iou: float = VIDEO_TRACK_IOU) -> list[tuple[int, int]]:
+    """
+    Greedy one to one matching of two sets of boxes: by IoU first, then by center distance.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return []
+
+    overlap = _iou(a, b)
+    center_a = (a[:, :2] + a[:, 2:]) / 2
+    center_b = (b[:, :2] + b[:, 2:]) / 2
+    distance = np.linalg.norm(center_a[:, None] - center_b[None, :], axis=2)
+    diagonal = np.linalg.norm(a[:, 2:] - a[:, :2], axis=1)[:, None]
+
+    # IoU in (0, 1] wins over any centroid match, which is ranked in (-1, 0] by its relative distance
+    score = np.where(overlap >= iou, overlap, -distance / np.maximum(diagonal, 1e-9))
+    score[(overlap < iou) & (distance > CENTROID_RATIO * diagonal)] = -np.inf
+
+    pairs = []
+    for flat in np.argsort(-score, axis=None):
+        i, j = np.unravel_index(flat, score.shape)
+        if score[i, j] == -np.inf:
+            break
+        if any(i == p or j == q for p, q in pairs):
+            continue
+        pairs.append((int(i), int(j)))
+    return pairs
+
+
+class Track:
+    def __init__(self, cls: int, box, conf: float, index: int, frame):
+        self.cls = cls
+        self.first = self.last = index
+        self.first_box = self.box = np.asarray(box, dtype=float)
+        self.hits = 1
+        self.missed = 0
+        self.best_conf = conf
+        self.best_box = self.box
+        self.best_frame = frame.copy()
+
+    def update(self, box, conf: float, index: int, frame):
+        self.box = np.asarray(box, dtype=float)
+        self.last = index
+        self.hits += 1
+        self.missed = 0
+        if conf > self.best_conf:  # only the best frame of the object is kept
+            self.best_conf = conf
+            self.best_box = self.box
+            self.best_frame = frame.copy()
+
+
+class IoUTracker:
+    """
+    SORT-like tracker without motion model: detections of a class are matched to the live tracks of that class,
+    a track survives ``max_gap`` frames without detection.
+    """
+
+    def __init__(self, iou: float = VIDEO_TRACK_IOU, max_gap: int = VIDEO_TRACK_GAP):
+        self.iou = iou
+        self.max_gap = max_gap
+        self.tracks: list[Track] = []
+
+    def update(self, index: int, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, frame) -> list[Track]:
+        """
+        :return: the tracks which are closed by this frame
+        """
+        matched = set()
+        for c in np.unique(np.concatenate([cls, [t.cls for t in self.tracks]]).astype(int)):
+            tracks = [t for t in self.tracks if t.cls == c]
+            detections = np.where(cls == c)[0]
+            boxes = np.array([t.box for t in tracks]).reshape(-1, 4)
+            for i, j in match(boxes, xyxy[detections], self.iou):
+                d = detections[j]
+                tracks[i].update(xyxy[d], float(conf[d]), index, frame)
+                matched.add(id(tracks[i]))
+                detections[j] = -1
+            for d in detections[detections >= 0]:
+                track = Track(int(c), xyxy[d], float(conf[d]), index, frame)
+                self.tracks.append(track)
+                matched.add(id(track))
+
+        closed = []
+        for track in self.tracks:
+            if id(track) not in matched:
+                track.missed += 1
+                if track.missed > self.max_gap:
+                    closed.append(track)
+        self.tracks = [t for t in self.tracks if t not in closed]
+        return closed
+
+    def close(self) -> list[Track]:
+        closed, self.tracks = self.tracks, []
+        return closed
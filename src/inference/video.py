@@ -0,0 +1,360 @@
+import logging
+import os
+import queue
+import threading
+import uuid
+
+import cv2
+import ffmpeg
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .backend import resolve_device, max_batch
+from .postprocess import class_thresholds, from_boxes, filter_detections
+from .registry import ModelSpec, get_model
+from .sampling import FrameGate, streak_threshold, VIDEO_FRAME_STRIDE, VIDEO_DIFF_THRESHOLD
+from .tracker import IoUTracker, Track, match, VIDEO_TRACK_GAP
+
+logger = logging.getLogger(__name__)
+
+limit = 0.2  # seconds
+VIDEO_FPS = 30  # every video is resampled to this frame rate before sampling
+
+# long edge of the decoded frames, ffmpeg scales straight to the model input size
+VIDEO_DECODE_SIZE = int(os.getenv("VIDEO_DECODE_SIZE", "640"))
+
+# longer videos are split in segments of about this length which are detected in parallel, 0 disables
+VIDEO_SEGMENT_SECONDS = float(os.getenv("VIDEO_SEGMENT_SECONDS", "60"))
+
+# frames which go through the model in one call
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "8"))
+# decoded frames / pending snapshots waiting between the stages
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", "32"))
+
+_end = object()  # the producer is done
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    # never block forever on a full queue when the other side is gone
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def _probe(filename, size: int) -> tuple[int, int, float]:  # return width, height and duration of the decoded video
+    info = ffmpeg.probe(filename)
+    stream = next(s for s in info['streams'] if s['codec_type'] == 'video')
+    width, height = int(stream['width']), int(stream['height'])
+
+    # phone videos are stored sideways with a rotation, ffmpeg rotates them while decoding
+    rotation = int(stream.get('tags', {}).get('rotate', 0))
+    for side_data in stream.get('side_data_list', []):
+        rotation = int(side_data.get('rotation', rotation))
+    if rotation % 180:
+        width, height = height, width
+
+    duration = float(info.get('format', {}).get('duration', stream.get('duration', 0)))
+
+    scale = min(1.0, size / max(width, height))
+    # most encoders / filters want even dimensions
+    return max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2), duration
+
+
+def _read_frame(stream, buffer: np.ndarray) -> bool:
+    view = memoryview(buffer).cast('B')
+    total = 0
+    while total < len(view):
+        n = stream.readinto(view[total:])
+        if not n:
+            return False
+        total += n
+    return True
+
+
+def _decode(stdout, buffers: queue.Queue, frames: queue.Queue, stop: threading.Event):
+    try:
+        while not stop.is_set():
+            buffer = _get(buffers, stop)
+            if buffer is None or not _read_frame(stdout, buffer):
+                break
+            _put(frames, buffer, stop)
+    finally:
+        _put(frames, _end, stop)
+
+
+def _write(snapshots: queue.Queue, errors: list):
+    while True:
+        item = snapshots.get()
+        if item is _end:
+            return
+        if errors:  # keep draining, so the inference stage is never blocked
+            continue
+
+        frame, boxes, path = item
+        try:
+            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            img_draw = ImageDraw.Draw(img)
+            for x1, y1, x2, y2 in boxes:
+                img_draw.rectangle([(x1, y1), (x2, y2)], outline='red', width=4)
+            img.save(path)
+        except Exception as e:
+            errors.append(e)
+
+
+def _next_batch(frames: queue.Queue, size: int) -> tuple[list, bool]:
+    batch = []
+    while len(batch) < size:
+        frame = frames.get()
+        if frame is _end:
+            return batch, True
+        batch.append(frame)
+    return batch, False
+
+
+def _record(track: Track, names, path: str | None, open_start: bool, open_end: bool) -> dict:
+    return {'name': names[track.cls], 'first': track.first, 'last': track.last, 'hits': track.hits,
+            'first_box': track.first_box.tolist(), 'last_box': track.box.tolist(), 'conf': track.best_conf,
+            'path': path, 'open_start': open_start, 'open_end': open_end}
+
+
+class SegmentTracker:
+    """
+    Tracks of the sampled frames of one segment (or of the whole video), turned into the records of
+    ``merge_segment_results`` when they are closed.
+
+    :param offset: index of the first frame of the segment
+    :param continued: whether a previous segment ends where this one starts
+    """
+
+    def __init__(self, names, min_hits: int, offset: int = 0, continued: bool = False):
+        self.names = names
+        self.min_hits = min_hits
+        self.offset = offset
+        self.continued = continued
+        self.tracker = IoUTracker()
+
+    def _records(self, tracks: list[Track], open_end: bool) -> list[tuple[Track, dict]]:
+        records = []
+        for track in tracks:
+            open_start = self.continued and track.first <= self.offset + self.tracker.max_gap
+            if track.hits < self.min_hits and not (open_start or open_end):
+                continue  # flickering detection
+            path = f"img/{uuid.uuid4().hex}.jpg"
+            records.append((track, _record(track, self.names, path, open_start, open_end)))
+        return records
+
+    def update(self, index: int, detections, frame) -> list[tuple[Track, dict]]:
+        return self._records(self.tracker.update(index, *detections, frame), False)
+
+    def close(self, open_end: bool) -> list[tuple[Track, dict]]:
+        """
+        :param open_end: whether a next segment may continue the tracks which are still alive
+        """
+        return self._records(self.tracker.close(), open_end)
+
+
+def _detect_video(spec: ModelSpec, filename, stride, diff_threshold, batch_size, progress, start=0.0, length=None):
+    """
+    Detect the ingredients of a video, every object track which was seen for ``limit`` seconds gets one snapshot
+    of its most confident frame. The result is a list of track records, see ``merge_segment_results``.
+
+    Decoding, inference and snapshot encoding run as three stages connected by bounded queues:
+    a decoder thread, batched inference on the calling thread and a writer thread.
+    ffmpeg resamples, strides and scales the video and writes raw BGR frames to a pipe,
+    which are read into a fixed set of preallocated buffers.
+
+    Only ``length`` seconds from ``start`` are detected when they are given. Tracks which may continue in the
+    previous or the next segment are always kept (``open_start`` / ``open_end``), they are joined afterwards.
+
+    :param progress: called with (frames done, frames total) after every batch
+    """
+    model = get_model(spec)
+    batch_size = max_batch(spec, batch_size)
+    thresholds = class_thresholds(model.names)
+    gate = FrameGate(diff_threshold)
+
+    width, height, duration = _probe(filename, VIDEO_DECODE_SIZE)
+
+    window = {}
+    if start > 0:
+        window['ss'] = start
+    if length is not None:
+        window['t'] = length
+    else:
+        length = duration - start
+
+    # sampled frames are numbered from the beginning of the video, so the segments can be joined
+    offset = round(start * VIDEO_FPS / stride)
+    # a track needs this many detections, so it still means "seen for `limit` seconds"
+    tracks = SegmentTracker(model.names, streak_threshold(VIDEO_FPS, stride, limit) + 1, offset, start > 0)
+    frames_total = int(length * VIDEO_FPS / stride)
+    frames_done = 0
+    process = (
+        ffmpeg.input(f"{filename}", **window)
+        .filter('fps', fps=VIDEO_FPS / stride)
+        .filter('scale', width, height)
+        .output('pipe:', format='rawvideo', pix_fmt='bgr24')
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+    stop = threading.Event()
+    buffers = queue.Queue()
+    for _ in range(VIDEO_QUEUE_SIZE + batch_size + 1):
+        buffers.put(np.empty((height, width, 3), dtype=np.uint8))
+    frames = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+    snapshots = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+    errors = []
+    decoder = threading.Thread(target=_decode, args=(process.stdout, buffers, frames, stop), daemon=True)
+    writer = threading.Thread(target=_write, args=(snapshots, errors), daemon=True)
+    decoder.start()
+    writer.start()
+
+    records = []
+
+    def finish(closed):
+        for track, record in closed:
+            records.append(record)
+            _put(snapshots, (track.best_frame, [track.best_box.tolist()], record['path']), stop)
+
+    detections = filter_detections(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=int), thresholds)
+    index_of_frame = offset - 1
+    try:
+        finished = False
+        while not finished:
+            batch, finished = _next_batch(frames, batch_size)
+            if not batch:
+                break
+
+            # a frame which barely changed keeps the detections of the last inferred frame
+            need = [gate.need_inference(frame) for frame in batch]
+            inferred = [frame for frame, n in zip(batch, need) if n]
+            results = iter(model(inferred, verbose=False, device=resolve_device()) if inferred else [])
+
+            for frame, n in zip(batch, need):
+                index_of_frame += 1
+                if n:
+                    detections = filter_detections(*from_boxes(next(results).boxes), thresholds)
+                # tracks copy their best frame, the buffer itself goes back to the decoder
+                finish(tracks.update(index_of_frame, detections, frame))
+
+            for frame in batch:
+                buffers.put(frame)
+
+            frames_done += len(batch)
+            if progress is not None:
+                progress(frames_done, max(frames_total, frames_done))
+
+        # the last segment ends with the video, every other one may be continued by the next segment
+        finish(tracks.close('t' in window))
+    finally:
+        stop.set()
+        killed = process.poll() is None
+        if killed:  # stopped before the end of the video
+            process.kill()
+        decoder.join()
+        process.stdout.close()
+        if process.wait() and not killed:
+            logger.warning(f"ffmpeg exit with {process.returncode} while decoding {filename}")
+        stop.clear()
+        _put(snapshots, _end, stop)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+    return records
+
+
+def video_processing(spec: ModelSpec, filename, stride=VIDEO_FRAME_STRIDE, diff_threshold=VIDEO_DIFF_THRESHOLD,
+                     batch_size=VIDEO_BATCH_SIZE, progress=None):
+    records = _detect_video(spec, filename, stride, diff_threshold, batch_size, progress)
+    os.remove(filename)
+    return merge_segment_results([records], stride)
+
+
+def video_segment_processing(spec: ModelSpec, filename, start: float, length: float | None,
+                             stride=VIDEO_FRAME_STRIDE, diff_threshold=VIDEO_DIFF_THRESHOLD,
+                             batch_size=VIDEO_BATCH_SIZE, progress=None):
+    # the file is shared by all the segments, the caller removes it
+    return _detect_video(spec, filename, stride, diff_threshold, batch_size, progress, start, length)
+
+
+def plan_segments(filename, segment_seconds: float = VIDEO_SEGMENT_SECONDS) -> list[tuple[float, float | None]]:
+    """
+    Split a video in (start, length) segments, an empty list means the video is too short to be worth it.
+    The last segment runs to the end of the video (length ``None``).
+    """
+    if segment_seconds <= 0:
+        return []
+
+    _, _, duration = _probe(filename, VIDEO_DECODE_SIZE)
+    count = int(duration // segment_seconds)
+    if count < 2:
+        return []
+
+    length = duration / count
+    return [(i * length, length if i < count - 1 else None) for i in range(count)]
+
+
+def merge_segment_results(segments: list[list[dict]], stride=VIDEO_FRAME_STRIDE,
+                          max_gap: int = VIDEO_TRACK_GAP) -> dict[str, list[str]]:
+    """
+    Join the tracks of consecutive segments and return {"name": [snapshot path]} in time order.
+
+    A track which is still open at the end of a segment continues the track of the same ingredient
+    that starts at the beginning of the next one when their boxes match and, like in a single pass,
+    it was missed for at most ``max_gap`` frames in between. The joined track keeps the best snapshot,
+    the other one is removed, as are the snapshots of tracks which are too short in the end.
+    """
+    min_hits = streak_threshold(VIDEO_FPS, stride, limit) + 1
+    tracks = []
+    pending = []  # open at the end of the previous segment
+    for records in segments:
+        starting = [r for r in records if r['open_start']]
+        joined = set()
+        for name in {r['name'] for r in starting}:
+            before = [r for r in pending if r['name'] == name]
+            after = [r for r in starting if r['name'] == name]
+            pairs = match(np.array([r['last_box'] for r in before]).reshape(-1, 4),
+                          np.array([r['first_box'] for r in after]).reshape(-1, 4))
+            for i, j in pairs:
+                if after[j]['first'] - before[i]['last'] - 1 > max_gap:
+                    continue  # a single pass would have closed the track in between
+                previous, record = before[i], after[j]
+                worse = record if previous['conf'] >= record['conf'] else previous
+                best = previous if worse is record else record
+                _discard(worse['path'])
+                previous.update(last=record['last'], last_box=record['last_box'], hits=previous['hits'] + record['hits'],
+                                conf=best['conf'], path=best['path'], open_end=record['open_end'])
+                joined.add(id(record))
+
+        tracks.extend(r for r in records if id(r) not in joined)
+        pending = [r for r in tracks if r['open_end']]
+        for r in pending:
+            r['open_end'] = False  # only the next segment can continue it
+
+    result = {}
+    for record in sorted(tracks, key=lambda r: r['first']):
+        if record['hits'] < min_hits:
+            _discard(record['path'])
+            continue
+        result.setdefault(record['name'], []).append(record['path'])
+    return result
+
+
+def _discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import select, update, insert
 
+from catalog import catalog
 from request.ingredient import ChangeNameRequest, AddSubIngredient, IngredientCreate
 from sql_app.db import AsyncDBSession
 from sql_app.model.Recipe import Ingredient, SubIngredient
@@ -26,6 +27,7 @@ async def change_mandarin(db: AsyncDBSession, data: ChangeNameRequest):
     except Exception as e:
         await db.rollback()
         raise e
+    catalog.invalidate()
 
     return {'message': 'upload success'}
 
@@ -39,6 +41,7 @@ async def add_sub(db: AsyncDBSession, data: AddSubIngredient):
     except Exception as e:
         await db.rollback()
         raise e
+    catalog.invalidate()
 
     return {'message': 'upload success'}
 
@@ -55,5 +58,6 @@ async def create_recipe(info: IngredientCreate, db: AsyncDBSession, user: User =
     except Exception as e:
         await db.rollback()
         raise e
+    catalog.invalidate()
 
     return{'message': 'upload success'}
\ No newline at end of file
@@ -1,51 +1,65 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, update, and_, text
+from sqlalchemy import select, update, func
 
 from request.made import MadeUpload, MadeUploadList
 from sql_app.db import AsyncDBSession
 from sql_app.model.Recipe import made, Recipe
 from sql_app.model.User import User
 from user import token_verify
+from search import ingredient_index, keyword_index
+from stats import ensure_stats, add_ingredients
 
 m_router = APIRouter(prefix="/made", tags=['made'])
 
-update_weight = text(
+async def update_weights(db: AsyncDBSession, rtype: int | None, iids: list[int]):
     """
-    UPDATE backend.made
-    INNER JOIN (
-        SELECT
-            rid,
-            iid,
-            COUNT(iid) AS weight
-        FROM backend.recipe
-        INNER JOIN backend.made
-            ON recipe.id = made.rid
-        GROUP BY rtype,iid
-    ) AS b
-    ON backend.made.rid = b.rid and backend.made.iid=b.iid
-    SET
-        backend.made.weight = b.weight
-    where
-        backend.made.weight<>b.weight;
+    The weight of an ingredient in a recipe is the number of recipes of the same type made of it.
+    Only the (rtype, iid) groups of the linked ingredients change, the rest of the table is untouched.
     """
-)
+    same_type = Recipe.rtype.is_(None) if rtype is None else Recipe.rtype == rtype
+    counts = (await db.execute(
+        select(made.c.iid, func.count()).join(Recipe, Recipe.id == made.c.rid)
+        .where(same_type, made.c.iid.in_(iids)).group_by(made.c.iid)
+    )).all()
+
+    recipes = select(Recipe.id).where(same_type)
+    for iid, weight in counts:
+        await db.execute(update(made).where(made.c.iid == iid, made.c.rid.in_(recipes), made.c.weight != weight)
+                         .values(weight=weight))
 
-@m_router.post('/create')
-async def by_id(db: AsyncDBSession, request: MadeUpload, user: User = Depends(token_verify)):
-    if user.level <= 127:
-        print(user.level)
-        raise HTTPException(status_code=401, detail='You are not administrator')
-    mades = made.insert().values(rid=request.rid, iid=request.iid, weight=1.0)
+
+async def link_ingredients(db: AsyncDBSession, rid: int, iids: list[int]):
+    # one multi-row insert and one transaction for all the ingredients
+    iids = list(dict.fromkeys(iids))
+    if not iids:
+        return
+
+    recipe = (await db.execute(select(Recipe.rtype).where(Recipe.id == rid))).first()
+    if recipe is None:
+        raise HTTPException(status_code=404, detail='Recipe not found')
 
     try:
-        await db.execute(mades)
-        await db.commit()
-        await db.execute(update_weight)
+        await ensure_stats(db, [rid])
+        await db.execute(made.insert().values([{'rid': rid, 'iid': iid, 'weight': 1.0} for iid in iids]))
+        await add_ingredients(db, rid, len(iids))
+        await update_weights(db, recipe.rtype, iids)
         await db.commit()
     except Exception as e:
         await db.rollback()
         raise e
 
+    # the weights of the other recipes with these ingredients changed too
+    await ingredient_index.refresh(db, iids)
+    await keyword_index.refresh(db, [rid])
+
+
+@m_router.post('/create')
+async def by_id(db: AsyncDBSession, request: MadeUpload, user: User = Depends(token_verify)):
+    if user.level <= 127:
+        print(user.level)
+        raise HTTPException(status_code=401, detail='You are not administrator')
+
+    await link_ingredients(db, request.rid, [request.iid])
     return {'message': 'upload success'}
 
 
@@ -54,19 +68,6 @@ async def by_id(db: AsyncDBSession, request: MadeUploadList, user: User = Depend
     if user.level <= 127:
         print(user.level)
         raise HTTPException(status_code=401, detail='You are not administrator')
-    for iid in request.iids:
-        temp = made.insert().values(rid=request.rid, iid=iid, weight=1.0)
-        try:
-            await db.execute(temp)
-            await db.commit()
-        except Exception as e:
-            await db.rollback()
-            raise e
 
-    try:
-        await db.execute(update_weight)
-        await db.commit()
-    except Exception as e:
-        await db.rollback()
-        raise e
+    await link_ingredients(db, request.rid, request.iids)
     return {'message': 'upload success'}
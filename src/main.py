@@ -2,14 +2,15 @@ import logging
 import os
 
 from fastapi import FastAPI, APIRouter
-from starlette.staticfiles import StaticFiles
 
-from detect import detection_router
+from detect import detection_router, video_jobs, gemini_files
+from inference.render import RenderedFiles
 from made import m_router
 from ingredient import i_router
 from test import test_router
 from user import user_root
 from recipe import recipe_root
+from stats import fill_on_startup
 from video import video_root
 
 logging.basicConfig(level=logging.DEBUG)
@@ -36,5 +37,10 @@ app.include_router(i_router)
 app.include_router(m_router)
 app.include_router(video_root)
 
+app.add_event_handler("startup", fill_on_startup)
+app.add_event_handler("startup", video_jobs.start)
+app.add_event_handler("shutdown", video_jobs.stop)
+app.add_event_handler("shutdown", gemini_files.close)
+
 os.makedirs('img', exist_ok=True)
-app.mount("/img", StaticFiles(directory="img"), name="img")
+app.mount("/img", RenderedFiles(directory="img"), name="img")  # detection images are drawn on demand
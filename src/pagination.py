@@ -0,0 +1,44 @@
+import base64
+import json
+import math
+
+from fastapi import HTTPException, Response
+
+PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values) -> str:
+    """
+    Opaque token of the sort key of the last row on a page, the next page starts after it.
+    """
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _valid(value, kind: type) -> bool:
+    if isinstance(value, bool):  # a bool is an int to python, never to a sort key
+        return False
+    if kind is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, kind)
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    """
+    :param types: type of each value of the sort key, ``float`` also takes an int
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(_valid(value, kind) for value, kind in zip(values, types))):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return values
+
+
+def set_next_cursor(response: Response, values, count: int, limit: int = PAGE_SIZE):
+    # the body keeps its old shape, the token goes to a header. No header on the last page
+    if values is not None and count >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(values)
@@ -1,7 +1,8 @@
 import os
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response, UploadFile, File
 from fastapi.params import Query
+from starlette.concurrency import run_in_threadpool
 
 from sql_app.db import AsyncDBSession
 from sqlalchemy import select, delete, func, text
@@ -12,6 +13,12 @@ from sql_app.model.User import *
 from response.recipe import *
 from response.utils import SuccessResponse
 from user import token_verify
+from catalog import catalog
+from search import ingredient_index, keyword_index, recipe_rows
+from pagination import PAGE_SIZE, decode_cursor, set_next_cursor
+from stats import ensure_stats, apply_rating, score_column
+from importer import RecipeImport
+from upload import check_upload_size, IMPORT_UPLOAD_LIMIT
 from discord_webhook import DiscordWebhook
 
 
@@ -32,16 +39,40 @@ async def create_recipe(info: RecipeUpload, db: AsyncDBSession, user: User = Dep
         await db.refresh(new_recipe)
         rid = new_recipe.id
         await db.execute(author.insert().values(uid=uid, rid=rid))
+        db.add(RecipeStats(rid=rid, rating_sum=0, rating_count=0, ingredient_count=0, comment_count=0))
         await db.commit()
     except Exception as e:
         await db.rollback()
         raise e
+    await keyword_index.refresh(db, [rid])
 
     webhook = DiscordWebhook(url=recipe_webhook, content=f"# {rid}.{info.name}\n{info.description}")
     _ = webhook.execute()
 
     return {"rid": rid}
 
+@recipe_root.post("/import")
+async def import_recipes(db: AsyncDBSession, user: User = Depends(token_verify),
+                         file: UploadFile = File(...)) -> ImportResponse:
+    """
+    Import recipes from NDJSON (one record per line) or CSV (a ``.csv`` file with a header row).
+
+    A record holds name, description, video_link, rtype, author (user id, you without it) and iids.
+    """
+    if user.level < 128:
+        raise HTTPException(status_code=404)
+    check_upload_size(file, IMPORT_UPLOAD_LIMIT)
+
+    csv_format = (file.filename or '').lower().endswith('.csv') or file.content_type == 'text/csv'
+    result = await RecipeImport(db, user.id).run(file, csv_format)
+
+    # one message for the whole import instead of one per recipe
+    webhook = DiscordWebhook(url=recipe_webhook, content=f"# import\n{result['imported']} recipes imported, "
+                                                         f"{result['failed']} failed")
+    _ = await run_in_threadpool(webhook.execute)
+
+    return result
+
 @recipe_root.post("/type/create")
 async def create_recipe_type(info: RecipeTypeRequest, db: AsyncDBSession, user: User = Depends(token_verify)) -> SuccessResponse:
     if user.level < 128:
@@ -72,10 +103,25 @@ async def create_recipe_type( db: AsyncDBSession):
     return types
 
 @recipe_root.get("/list/{offset}")
-async def recipe_list(offset: int, db: AsyncDBSession):
-    stmt = select(Recipe).offset(offset * 100).limit(100)
+async def recipe_list(offset: int, db: AsyncDBSession, response: Response):
+    stmt = select(Recipe).order_by(Recipe.id).offset(offset * PAGE_SIZE).limit(PAGE_SIZE)
     result = await db.execute(stmt)
     result_list = result.scalars().all()
+    set_next_cursor(response, [result_list[-1].id] if result_list else None, len(result_list))
+    return result_list
+
+
+@recipe_root.get("/list")
+async def recipe_list_after(db: AsyncDBSession, response: Response, cursor: str | None = None):
+    """
+    :param cursor: ``X-Next-Cursor`` of the previous page, the first page without it
+    """
+    stmt = select(Recipe).order_by(Recipe.id).limit(PAGE_SIZE)
+    if cursor:
+        stmt = stmt.where(Recipe.id > decode_cursor(cursor, int)[0])
+    result = await db.execute(stmt)
+    result_list = result.scalars().all()
+    set_next_cursor(response, [result_list[-1].id] if result_list else None, len(result_list))
     return result_list
 
 
@@ -95,132 +141,40 @@ async def delete_recipe_type(tid: int, db: AsyncDBSession, user: User = Depends(
     stmt = delete(RecipeType).where(RecipeType.id == tid)
     await db.execute(stmt)
     await db.commit()
+    ingredient_index.invalidate()  # its recipes are not found by search anymore
+    keyword_index.invalidate()
 
     return {'message': 'delete success'}
 
-search_by_iids_stmt = text(
+@recipe_root.get("/search/iid")
+async def search_by_iid(db: AsyncDBSession, response: Response, offset:int = 0, cursor: str | None = None,
+                        iids:List[int] = Query(None), names:List[str] = Query(None)) -> List[RecipeSearchResponse]:
     """
-    select
-        made.rid as rid,
-        r.name as title,
-        video_link as link,
-        score.s as score
-    FROM backend.made
-    INNER JOIN backend.recipe r
-        on made.rid = r.id
-    INNER JOIN backend.author a
-        on backend.made.rid = a.rid
-    INNER JOIN backend.user u
-        on a.uid = u.id
-    INNER JOIN backend.recipe_type rt
-        on r.rtype = rt.id
-    LEFT OUTER JOIN (
-        SELECT AVG(comment.rate) as s,comment.recipe_id
-        FROM comment
-        GROUP BY comment.recipe_id
-    ) as score
-    ON score.recipe_id = r.id
-    WHERE
-        iid IN :iids
-    GROUP BY rid
-    HAVING
-        SUM(made.weight) <> 0
-    ORDER BY
-        SUM(made.weight) desc,
-        COUNT(made.weight) desc,
-        rid
-    LIMIT 100
-    OFFSET :offset
+    :param cursor: ``X-Next-Cursor`` of the previous page, ``offset`` is ignored when it is given
+    :param names: detected ingredient names (english or mandarin, sub-ingredients too), searched with ``iids``
     """
-)
+    after = decode_cursor(cursor, float, int, int) if cursor else None
+    iids = list(iids or [])
+    if names:
+        iids += (await catalog.get(db)).iids_of(names)
+    if not iids:
+        return []
+
+    # ranked in memory, only the page of recipes is read from the database
+    rids, last = (await ingredient_index.get(db)).search(iids, 0 if after else offset * PAGE_SIZE, after=after)
+    set_next_cursor(response, last, len(rids))
+    return await recipe_rows(db, rids)
 
-search_by_keyword_stmt = text(
+@recipe_root.get("/search/keyword")
+async def search_by_keyword(keyword:str, db: AsyncDBSession, response: Response, offset:int = 0,
+                            cursor: str | None = None) -> List[RecipeSearchResponse]:
     """
-    select
-        r.id as rid,
-        r.name as title,
-        r.video_link as link,
-        score.s as score
-    FROM backend.recipe r
-    INNER JOIN backend.author a
-        ON r.id = a.rid
-    INNER JOIN backend.user
-        ON a.uid = user.id
-    INNER JOIN backend.recipe_type rt
-        on r.rtype = rt.id
-    INNER JOIN (
-        SELECT rid, COUNT(iid) as count
-        FROM made
-        GROUP BY rid
-    ) as ic
-    ON ic.rid = r.id
-    LEFT OUTER JOIN (
-        SELECT AVG(comment.rate) as s,comment.recipe_id
-        FROM comment
-        GROUP BY comment.recipe_id
-    ) as score
-    ON score.recipe_id = r.id
-    WHERE
-        r.name LIKE CONCAT('%',:keyword,'%') OR
-        r.description LIKE CONCAT('%',:keyword,'%') OR
-        rt.name LIKE CONCAT('%',:keyword,'%') OR
-        username LIKE CONCAT('%',:keyword,'%')
-    ORDER BY
-        CASE
-            WHEN rt.name = :keyword THEN 1
-            WHEN rt.name LIKE CONCAT('%',:keyword,'%') THEN 2
-            ELSE 3
-        END,
-        CASE
-            WHEN title = :keyword THEN 1
-            WHEN title LIKE CONCAT('%',:keyword,'%') THEN 2
-            ELSE 3
-        END,
-        ic.count
-        ,
-        CASE
-            WHEN username = :keyword THEN 1
-            WHEN username LIKE CONCAT('%',:keyword,'%') THEN 2
-            ELSE 3
-        END,
-        r.id
-    LIMIT 100
-    OFFSET :offset
+    :param cursor: ``X-Next-Cursor`` of the previous page, ``offset`` is ignored when it is given
     """
-)
-
-@recipe_root.get("/search/iid")
-async def search_by_iid(offset:int, db: AsyncDBSession, iids:List[int] = Query(None)) -> List[RecipeSearchResponse]:
-    result = await db.execute(search_by_iids_stmt,{"iids":iids,"offset":offset*100})
-
-    # Convert results to a list of dictionaries
-    response = [
-        {
-            "rid": row.rid,
-            "title": row.title,
-            "link": row.link,
-            "score":row.score,
-        }
-        for row in result
-    ]
-
-    return response
-
-@recipe_root.get("/search/keyword")
-async def search_by_keyword(keyword:str, offset:int, db: AsyncDBSession) -> List[RecipeSearchResponse]:
-    result = await db.execute(search_by_keyword_stmt,{"keyword":keyword,"offset":offset*100})
-
-    response = [
-        {
-            "rid": row.rid,
-            "title": row.title,
-            "link": row.link,
-            "score": row.score,
-        }
-        for row in result
-    ]
-
-    return response
+    after = decode_cursor(cursor, int, int, int, int, int) if cursor else None
+    rids, last = await keyword_index.search(db, keyword, 0 if after else offset * PAGE_SIZE, after=after)
+    set_next_cursor(response, last, len(rids))
+    return await recipe_rows(db, rids)
 
 recipe_search = text(
     """
@@ -280,10 +234,8 @@ async def read_recipe(rid: int, db: AsyncDBSession):
         for i in result
     ]
 
-    if len(comments):
-        avg = sum([x["score"] for x in comments]) / len(comments)
-    else:
-        avg = None
+    stats = (await db.execute(select(score_column).where(RecipeStats.rid == rid))).first()
+    avg = stats.score if stats else None
 
     connect = await db.execute(iids_stmt,{"rid":rid})
     result = connect.fetchall()
@@ -323,11 +275,14 @@ async def delete_recipe(rid: int, db: AsyncDBSession, user: User = Depends(token
 
     if user.level == 127 or user.id == recipe_author.id:
         stmt2 = delete(Recipe).where(Recipe.id == rid)
+        await db.execute(delete(RecipeStats).where(RecipeStats.rid == rid))
         await db.execute(stmt2)
         await db.commit()
         stmt3 = delete(author).where(author.c.rid == rid)
         await db.execute(stmt3)
         await db.commit()
+        ingredient_index.invalidate()
+        await keyword_index.remove(rid)
     else:
         raise HTTPException(status_code=404)
 
@@ -349,7 +304,11 @@ async def post_comment(post:CommentCreate, db:AsyncDBSession, user = Depends(tok
         raise HTTPException(status_code=400, detail="rate must be between 0 and 5")
 
     try:
+        stmt = select(Comment.rate).where(Comment.id == user.id, Comment.recipe_id == post.rid).with_for_update()
+        old_rate = (await db.execute(stmt)).scalar()
+        await ensure_stats(db, [post.rid])
         await db.execute(insert_comment,{"uid":user.id,"rid":post.rid,"comment":post.content,"rate":post.rate})
+        await apply_rating(db, post.rid, old_rate, post.rate)
         await db.commit()
     except Exception as e:
         await db.rollback()
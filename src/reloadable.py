@@ -0,0 +1,40 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+
+class Reloadable:
+    """
+    Version and age of an in-memory copy of some tables.
+
+    Writers call ``invalidate`` after their commit. The first reader which finds the copy stale reloads it
+    under ``_lock``, the readers waiting behind it use that load. The copy is also reloaded after ``ttl``
+    seconds, another process of the server may have changed the tables.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self._loaded_version = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def _fresh(self) -> bool:
+        return self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _ensure(self, load: Callable[[int], Awaitable[None]]):
+        """
+        :param load: replaces the copy, called with the version it is loaded for
+        """
+        if self._fresh():
+            return
+
+        async with self._lock:
+            if not self._fresh():  # someone else may have loaded it while we were waiting
+                version = self.version
+                await load(version)
+                self._loaded_version = version
+                self._loaded_at = time.monotonic()
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, validator
 
 
 class RecipeUpload(BaseModel):
@@ -21,4 +23,18 @@ class RecipeTypeRequest(BaseModel):
 class CommentCreate(BaseModel):
     rid: int
     content:str
-    rate:int
\ No newline at end of file
+    rate:int
+
+class RecipeImportRecord(RecipeUpload):
+    author: int = None  # user id, the importing user without it
+    iids: List[int] = []
+
+    @validator('video_link', 'rtype', 'author', pre=True)
+    def empty_is_none(cls, value):  # empty csv cells
+        return None if value == '' else value
+
+    @validator('iids', pre=True)
+    def split_iids(cls, value):  # "1;2;3" in csv
+        if isinstance(value, str):
+            return [iid for iid in value.replace(';', ' ').replace(',', ' ').split()]
+        return value
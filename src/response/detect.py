@@ -0,0 +1,22 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class DetectionResponse(BaseModel):
+    render_id: str
+    path: str  # annotated image, drawn when it is requested for the first time
+    boxes: List[List[float]]  # [(x1,y1,x2,y2)]
+
+
+class VideoJobCreated(BaseModel):
+    job_id: str
+
+
+class VideoJobResponse(BaseModel):
+    id: str
+    version: str
+    state: str  # queued, running, done, failed
+    frames_done: int
+    frames_total: Optional[int]
+    error: Optional[str]
@@ -23,3 +23,14 @@ class RecipeSearchResponse(BaseModel):
     link :str
     score :float|None
 
+
+
+class ImportRecordError(BaseModel):
+    line: int  # line of the record in the uploaded file
+    detail: str
+
+
+class ImportResponse(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRecordError]  # the first IMPORT_MAX_ERRORS failures
@@ -0,0 +1,315 @@
+import functools
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from pagination import PAGE_SIZE
+from reloadable import Reloadable
+from sql_app.model.Recipe import made, Recipe, RecipeType, RecipeStats
+from sql_app.model.User import User, author
+from stats import score_column
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "300"))  # seconds, see ``Reloadable``
+
+
+def _postings_stmt(iids: list[int] | None = None):
+    # the same joins as the old search query, a recipe without an author or a type is never found.
+    # every author multiplies the row, so n is what COUNT(made.weight) counted there
+    stmt = (
+        select(made.c.iid, made.c.rid, made.c.weight, func.count().label('n'))
+        .join(Recipe, made.c.rid == Recipe.id)
+        .join(author, made.c.rid == author.c.rid)
+        .join(User, author.c.uid == User.id)
+        .join(RecipeType, Recipe.rtype == RecipeType.id)
+        .group_by(made.c.iid, made.c.rid, made.c.weight)
+    )
+    if iids is not None:
+        stmt = stmt.where(made.c.iid.in_(iids))
+    return stmt
+
+
+def _postings(rows) -> dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.iid, []).append((row.rid, row.weight * row.n, row.n))
+    return {
+        iid: (np.array([p[0] for p in entries], dtype=np.int64),
+              np.array([p[1] for p in entries], dtype=np.float64),
+              np.array([p[2] for p in entries], dtype=np.int64))
+        for iid, entries in grouped.items()
+    }
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    version: int
+    postings: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = field(default_factory=dict)  # iid: (rid, weight, count)
+
+    def search(self, iids: Iterable[int], offset: int = 0, limit: int = PAGE_SIZE,
+               after: tuple | None = None) -> tuple[list[int], tuple | None]:
+        """
+        Recipe ids ordered by SUM(weight) desc, COUNT desc, rid over the requested ingredients.
+
+        :param after: sort key of the last recipe of the previous page, the page starts after it
+        :return: the page and the sort key (sum, count, rid) of its last recipe
+        """
+        lists = [self.postings[iid] for iid in dict.fromkeys(iids) if iid in self.postings]
+        if not lists:
+            return [], None
+
+        rids, inverse = np.unique(np.concatenate([p[0] for p in lists]), return_inverse=True)
+        sums = np.bincount(inverse, weights=np.concatenate([p[1] for p in lists]))
+        counts = np.bincount(inverse, weights=np.concatenate([p[2] for p in lists]))
+
+        candidates = np.nonzero(sums != 0)[0]
+        if after is not None:
+            s, c, r = after
+            later = (sums < s) | ((sums == s) & ((counts < c) | ((counts == c) & (rids > r))))
+            candidates = candidates[later[candidates]]
+
+        end = offset + limit
+        if end < len(candidates):  # only the best ``end`` (and their ties) have to be sorted
+            kth = np.partition(-sums[candidates], end - 1)[end - 1]
+            candidates = candidates[-sums[candidates] <= kth]
+
+        order = np.lexsort((rids[candidates], -counts[candidates], -sums[candidates]))
+        page = candidates[order][offset:end]
+        if len(page) == 0:
+            return [], None
+        last = page[-1]
+        return rids[page].tolist(), (float(sums[last]), int(counts[last]), int(rids[last]))
+
+
+class IngredientIndex(Reloadable):
+    """
+    Inverted index from ingredient id to the recipes made of it, built from the ``made`` table.
+
+    Like the ingredient catalog, readers get an immutable snapshot. ``refresh`` replaces the postings of
+    some ingredients after the ``/made`` endpoints changed them, ``invalidate`` rebuilds everything.
+    """
+
+    def __init__(self):
+        super().__init__(SEARCH_INDEX_TTL)
+        self._snapshot: IndexSnapshot | None = None
+
+    async def get(self, db: AsyncSession) -> IndexSnapshot:
+        await self._ensure(functools.partial(self._load, db))
+        return self._snapshot
+
+    async def _load(self, db: AsyncSession, version: int):
+        rows = (await db.execute(_postings_stmt())).all()
+        postings = await run_in_threadpool(_postings, rows)  # grouping every row, keep it off the event loop
+        self._snapshot = IndexSnapshot(version=version, postings=postings)
+        logger.debug(f"load ingredient index version {version} ({len(postings)} ingredients)")
+
+    async def refresh(self, db: AsyncSession, iids: Iterable[int]):
+        iids = list(dict.fromkeys(iids))
+        if not iids:
+            return
+
+        async with self._lock:
+            if not self._fresh():  # the next reader builds it from scratch anyway
+                return
+            postings = dict(self._snapshot.postings)
+            for iid in iids:
+                postings.pop(iid, None)
+            postings.update(_postings((await db.execute(_postings_stmt(iids))).all()))
+            self._snapshot = IndexSnapshot(version=self._snapshot.version, postings=postings)
+
+
+def _grams(value: str) -> set[str]:
+    # single characters and bigrams, chinese has no word boundaries to split on
+    value = value.lower()
+    return set(value) | {value[i:i + 2] for i in range(len(value) - 1)}
+
+
+def _tier(value: str | None, keyword: str) -> int:
+    if value is None:
+        return 3
+    value = value.lower()
+    if value == keyword:
+        return 1
+    return 2 if keyword in value else 3
+
+
+@dataclass
+class RecipeDocument:
+    rid: int
+    title: str
+    description: str
+    rtype: str
+    usernames: tuple[str, ...]
+    count: int  # number of ingredients
+
+    def fields(self) -> list[str]:
+        return [self.title, self.description, self.rtype, *self.usernames]
+
+    def matches(self, keyword: str) -> bool:
+        return any(keyword in value.lower() for value in self.fields())
+
+    def rank(self, keyword: str) -> tuple:
+        # exact type, partial type, then title, then fewer ingredients, then username
+        return (_tier(self.rtype, keyword), _tier(self.title, keyword), self.count,
+                min((_tier(name, keyword) for name in self.usernames), default=3), self.rid)
+
+
+def _documents_stmt(rids: list[int] | None = None):
+    # the same joins as the old keyword query, a recipe needs an author, a type and an ingredient
+    stmt = (
+        select(Recipe.id, Recipe.name, Recipe.description, RecipeType.name.label('rtype'), User.username,
+               RecipeStats.ingredient_count.label('count'))
+        .join(author, Recipe.id == author.c.rid)
+        .join(User, author.c.uid == User.id)
+        .join(RecipeType, Recipe.rtype == RecipeType.id)
+        .join(RecipeStats, RecipeStats.rid == Recipe.id)
+        .where(RecipeStats.ingredient_count > 0)
+    )
+    if rids is not None:
+        stmt = stmt.where(Recipe.id.in_(rids))
+    return stmt
+
+
+def _documents(rows) -> dict[int, RecipeDocument]:
+    documents = {}
+    for row in rows:
+        document = documents.get(row.id)
+        if document is None:
+            documents[row.id] = RecipeDocument(row.id, row.name, row.description, row.rtype, (row.username,), row.count)
+        else:  # one row per author
+            document.usernames += (row.username,)
+    return documents
+
+
+def _index_grams(grams: dict[str, set[int]], document: RecipeDocument):
+    for value in document.fields():
+        for gram in _grams(value):
+            grams.setdefault(gram, set()).add(document.rid)
+
+
+def _keyword_index(rows) -> tuple[dict[int, RecipeDocument], dict[str, set[int]]]:
+    # runs in the threadpool, the whole table is split into grams
+    documents, grams = _documents(rows), {}
+    for document in documents.values():
+        _index_grams(grams, document)
+    return documents, grams
+
+
+class KeywordIndex(Reloadable):
+    """
+    N-gram index over the recipe title, description, type and author names, for substring search.
+
+    A keyword's candidates are the recipes holding all of its bigrams, they are checked with a substring
+    match and ranked in memory. A rebuild is made in the threadpool and swapped in whole, the small updates
+    wait for a rebuild in progress and change it in place: both they and ``search`` run on the event loop
+    without awaiting in between, so a search never sees half an update.
+    """
+
+    def __init__(self):
+        super().__init__(SEARCH_INDEX_TTL)
+        self._documents: dict[int, RecipeDocument] = {}
+        self._grams: dict[str, set[int]] = {}
+
+    def _add(self, document: RecipeDocument):
+        self._documents[document.rid] = document
+        _index_grams(self._grams, document)
+
+    def _remove(self, rid: int):
+        document = self._documents.pop(rid, None)
+        if document is None:
+            return
+        for value in document.fields():
+            for gram in _grams(value):
+                rids = self._grams.get(gram)
+                if rids is not None:
+                    rids.discard(rid)
+                    if not rids:
+                        del self._grams[gram]
+
+    async def _load(self, db: AsyncSession, version: int):
+        rows = (await db.execute(_documents_stmt())).all()
+        documents, grams = await run_in_threadpool(_keyword_index, rows)
+        self._documents, self._grams = documents, grams
+        logger.debug(f"load keyword index version {version} ({len(documents)} recipes)")
+
+    async def refresh(self, db: AsyncSession, rids: Iterable[int]):
+        """
+        Reload some recipes after they were created or their ingredients changed.
+        """
+        rids = list(dict.fromkeys(rids))
+        if not rids:
+            return
+
+        # a rebuild in progress may have read the recipes before the caller's commit, apply it after that one
+        async with self._lock:
+            if not self._fresh():  # the next search builds it from scratch anyway
+                return
+            documents = _documents((await db.execute(_documents_stmt(rids))).all())
+            for rid in rids:
+                self._remove(rid)
+                if rid in documents:
+                    self._add(documents[rid])
+
+    async def remove(self, rid: int):
+        async with self._lock:
+            self._remove(rid)
+
+    async def search(self, db: AsyncSession, keyword: str, offset: int = 0, limit: int = PAGE_SIZE,
+                     after: tuple | None = None) -> tuple[list[int], tuple | None]:
+        """
+        :param after: rank of the last recipe of the previous page, the page starts after it
+        :return: the page and the rank of its last recipe
+        """
+        await self._ensure(functools.partial(self._load, db))
+
+        keyword = keyword.lower()
+        grams = _grams(keyword) if len(keyword) < 2 else {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+        if not grams:  # an empty keyword matches everything
+            candidates = set(self._documents)
+        else:
+            postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+
+        ranked = [(document.rank(keyword), document.rid) for document in map(self._documents.get, candidates)
+                  if document.matches(keyword)]
+        if after is not None:
+            after = tuple(after)
+            ranked = [item for item in ranked if item[0] > after]
+        ranked.sort()
+        page = ranked[offset:offset + limit]
+        return [rid for _, rid in page], (page[-1][0] if page else None)
+
+
+async def recipe_rows(db: AsyncSession, rids: list[int]) -> list[dict]:
+    """
+    Title, link and average rate of ``rids``, in the order of ``rids``.
+    """
+    if not rids:
+        return []
+
+    stmt = (
+        select(Recipe.id, Recipe.name, Recipe.video_link, score_column)
+        .outerjoin(RecipeStats, RecipeStats.rid == Recipe.id)
+        .where(Recipe.id.in_(rids))
+    )
+    rows = {row.id: row for row in (await db.execute(stmt)).all()}
+    return [
+        {
+            "rid": rid,
+            "title": rows[rid].name,
+            "link": rows[rid].video_link,
+            "score": rows[rid].score,
+        }
+        for rid in rids if rid in rows
+    ]
+
+
+ingredient_index = IngredientIndex()
+keyword_index = KeywordIndex()
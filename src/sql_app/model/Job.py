@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+
+from ..db import Base
+
+
+class VideoJob(Base):
+    __tablename__ = 'video_job'
+    id = Column(String(32), primary_key=True)
+    version = Column(String(30), nullable=False)  # model version
+    file_path = Column(String(60), nullable=False)  # uploaded video, removed when the job ends
+    state = Column(String(16), nullable=False, default='queued')  # queued, running, done, failed
+    frames_done = Column(Integer, nullable=False, default=0)
+    frames_total = Column(Integer, nullable=True)
+    result = Column(JSON, nullable=True)  # {"name": [snapshot path]}
+    error = Column(Text, nullable=True)
+    create_date = Column(DateTime, nullable=False)
+    update_date = Column(DateTime, nullable=False)
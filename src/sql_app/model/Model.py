@@ -6,6 +6,8 @@ class Model(Base):
     __tablename__ = 'model'
     id = Column(Integer, primary_key=True)
     file_path = Column(String(60), nullable=False)
+    onnx_path = Column(String(60), nullable=True)  # exported for CPU inference
+    openvino_path = Column(String(60), nullable=True)
     description = Column(TEXT, nullable=False)
     size = Column(String(30), nullable=False)
     version = Column(String(30), nullable=False)
@@ -46,3 +46,14 @@ class SubIngredient(Base):
     iid = Column(Integer, ForeignKey('ingredient.id'), nullable=False)
     name = Column(String(32), nullable=False)
     mandarin = Column(String(16), nullable=False)
+
+
+class RecipeStats(Base):
+    # kept by the endpoints which change comments or ingredients, in the same transaction.
+    # `python stats.py` rebuilds it from the source tables
+    __tablename__ = 'recipe_stats'
+    rid = Column(Integer, ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    ingredient_count = Column(Integer, nullable=False, default=0)
+    comment_count = Column(Integer, nullable=False, default=0)
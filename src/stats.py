@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from sqlalchemy import select, insert, update, delete, func, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sql_app.model.Recipe import made, Recipe, RecipeStats
+from sql_app.model.User import Comment
+
+logger = logging.getLogger(__name__)
+
+# average rate of a recipe, NULL without ratings like AVG(comment.rate) was
+score_column = case((RecipeStats.rating_count > 0, RecipeStats.rating_sum * 1.0 / RecipeStats.rating_count),
+                    else_=None).label('score')
+
+
+def _source_stmt(rids: list[int] | None = None):
+    # the statistics counted from the comment and made tables
+    ratings = (select(Comment.recipe_id, func.sum(Comment.rate).label('rating_sum'), func.count().label('n'))
+               .group_by(Comment.recipe_id).subquery())
+    ingredients = select(made.c.rid, func.count().label('n')).group_by(made.c.rid).subquery()
+    stmt = (
+        select(Recipe.id,
+               func.coalesce(ratings.c.rating_sum, 0),
+               func.coalesce(ratings.c.n, 0),
+               func.coalesce(ingredients.c.n, 0),
+               func.coalesce(ratings.c.n, 0))
+        .outerjoin(ratings, ratings.c.recipe_id == Recipe.id)
+        .outerjoin(ingredients, ingredients.c.rid == Recipe.id)
+    )
+    if rids is not None:
+        stmt = stmt.where(Recipe.id.in_(rids))
+    return stmt
+
+
+_columns = ['rid', 'rating_sum', 'rating_count', 'ingredient_count', 'comment_count']
+
+
+async def ensure_stats(db: AsyncSession, rids: Iterable[int]):
+    """
+    Create the missing statistics of ``rids`` from the source tables. Call it before changing them,
+    the caller's change is then applied on top with ``add_ingredients`` / ``apply_rating``.
+    """
+    rids = list(dict.fromkeys(rids))
+    existing = set((await db.execute(select(RecipeStats.rid).where(RecipeStats.rid.in_(rids)))).scalars())
+    missing = [rid for rid in rids if rid not in existing]
+    if missing:
+        await db.execute(insert(RecipeStats).from_select(_columns, _source_stmt(missing)))
+
+
+async def add_ingredients(db: AsyncSession, rid: int, count: int):
+    await db.execute(update(RecipeStats).where(RecipeStats.rid == rid)
+                     .values(ingredient_count=RecipeStats.ingredient_count + count))
+
+
+async def apply_rating(db: AsyncSession, rid: int, old_rate: int | None, new_rate: int):
+    # a user has one comment per recipe, posting again replaces the rate
+    if old_rate is None:
+        values = dict(rating_sum=RecipeStats.rating_sum + new_rate, rating_count=RecipeStats.rating_count + 1,
+                      comment_count=RecipeStats.comment_count + 1)
+    else:
+        values = dict(rating_sum=RecipeStats.rating_sum + new_rate - old_rate)
+    await db.execute(update(RecipeStats).where(RecipeStats.rid == rid).values(**values))
+
+
+async def backfill(db: AsyncSession) -> int:
+    """
+    Rebuild every recipe's statistics from the source tables in one transaction.
+
+    :return: number of recipes
+    """
+    try:
+        await db.execute(delete(RecipeStats))
+        await db.execute(insert(RecipeStats).from_select(_columns, _source_stmt()))
+        count = (await db.execute(select(func.count()).select_from(RecipeStats))).scalar()
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    return count
+
+
+async def fill_missing(db: AsyncSession) -> int:
+    """
+    Create the statistics of the recipes which have none, like the ones from before the table existed.
+    The existing rows are left as they are.
+
+    :return: number of recipes
+    """
+    has_stats = select(RecipeStats.rid).where(RecipeStats.rid == Recipe.id).exists()
+    try:
+        result = await db.execute(insert(RecipeStats).from_select(_columns, _source_stmt().where(~has_stats)))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    return result.rowcount
+
+
+async def fill_on_startup():
+    # the readers only look at recipe_stats, a recipe without a row has no score and no keyword match
+    from sql_app.db import async_session_factory
+
+    async with async_session_factory() as db:
+        try:
+            count = await fill_missing(db)
+        except IntegrityError:  # another worker of the server filled them at the same time
+            return
+    if count:
+        logger.info(f"created the missing statistics of {count} recipes")
+
+
+async def main():
+    from sql_app.db import async_session_factory
+
+    async with async_session_factory() as db:
+        count = await backfill(db)
+    logger.info(f"rebuilt the statistics of {count} recipes")
+
+
+if __name__ == '__main__':  # repair: python stats.py
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
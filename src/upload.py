@@ -0,0 +1,72 @@
+import hashlib
+import logging
+import os
+
+import aiofiles
+from fastapi import UploadFile, HTTPException
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# per endpoint limits (bytes)
+VIDEO_UPLOAD_LIMIT = int(os.getenv("VIDEO_UPLOAD_LIMIT", str(1024 * 1024 * 1024)))
+MODEL_UPLOAD_LIMIT = int(os.getenv("MODEL_UPLOAD_LIMIT", str(512 * 1024 * 1024)))
+GEMINI_UPLOAD_LIMIT = int(os.getenv("GEMINI_UPLOAD_LIMIT", str(20 * 1024 * 1024)))
+IMPORT_UPLOAD_LIMIT = int(os.getenv("IMPORT_UPLOAD_LIMIT", str(512 * 1024 * 1024)))
+
+
+def _too_large(max_size: int):
+    return HTTPException(status_code=413, detail=f'File is too large (limit is {max_size} bytes)')
+
+
+def check_upload_size(file: UploadFile, max_size: int):
+    if file.size is not None and file.size > max_size:  # known from the request, don't even start
+        raise _too_large(max_size)
+
+
+async def save_upload(file: UploadFile, path: str, max_size: int) -> tuple[int, str]:
+    """
+    Copy an upload to ``path`` chunk by chunk, so only one chunk is held in memory.
+
+    :return: size and sha256 of the content
+    """
+    check_upload_size(file, max_size)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(path, 'wb') as output_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise _too_large(max_size)
+                digest.update(chunk)
+                await output_file.write(chunk)
+    except BaseException:
+        if os.path.exists(path):  # don't leave a partial file behind
+            os.remove(path)
+        raise
+
+    return size, digest.hexdigest()
+
+
+async def read_upload(file: UploadFile, max_size: int) -> tuple[bytes, str]:
+    """
+    Read a (small) upload into memory, with the same limit checks as ``save_upload``.
+
+    :return: content and sha256 of the content
+    """
+    check_upload_size(file, max_size)
+
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise _too_large(max_size)
+        digest.update(chunk)
+        chunks.append(chunk)
+
+    return b''.join(chunks), digest.hexdigest()
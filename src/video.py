@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy import select, update, func
 
+from pagination import PAGE_SIZE, decode_cursor, set_next_cursor
 from request.video import VideoRequest
 from response.utils import SuccessResponse
 from sql_app.db import AsyncDBSession
@@ -38,13 +39,33 @@ async def import_video(db: AsyncDBSession, info: VideoRequest, user: User = Depe
 
 
 @video_root.get('/list/{offset}')
-async def list_video(db: AsyncDBSession, offset: int, user: User = Depends(token_verify)):
+async def list_video(db: AsyncDBSession, offset: int, response: Response, user: User = Depends(token_verify)):
     if user.level < 127:
         raise HTTPException(status_code=401, detail='You are not administrator')
-    stmt = select(Video).offset(offset * 100).limit(100)
+    stmt = select(Video).order_by(Video.id).offset(offset * PAGE_SIZE).limit(PAGE_SIZE)
 
     result = await db.execute(stmt)
     videos = result.scalars().all()
+    set_next_cursor(response, [videos[-1].id] if videos else None, len(videos))
+
+    return videos
+
+
+@video_root.get('/list')
+async def list_video_after(db: AsyncDBSession, response: Response, cursor: str | None = None,
+                           user: User = Depends(token_verify)):
+    """
+    :param cursor: ``X-Next-Cursor`` of the previous page, the first page without it
+    """
+    if user.level < 127:
+        raise HTTPException(status_code=401, detail='You are not administrator')
+    stmt = select(Video).order_by(Video.id).limit(PAGE_SIZE)
+    if cursor:
+        stmt = stmt.where(Video.id > decode_cursor(cursor, int)[0])
+
+    result = await db.execute(stmt)
+    videos = result.scalars().all()
+    set_next_cursor(response, [videos[-1].id] if videos else None, len(videos))
 
     return videos
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules import each other from src, like when the app is started there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
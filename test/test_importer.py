@@ -0,0 +1,69 @@
+import csv
+import io
+
+import pytest
+
+from importer import _csv, _ndjson, _next_chunk
+from request.recipe import RecipeImportRecord
+
+
+def text(data: bytes) -> io.TextIOWrapper:
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+
+
+class TestNdjson:
+    def test_line_numbers_skip_blank_lines(self):
+        records = list(_ndjson(text(b'{"name": "a"}\n\n{"name": "b"}\n')))
+        assert records == [(1, {'name': 'a'}), (3, {'name': 'b'})]
+
+    def test_invalid_json_is_reported(self):
+        [(number, error)] = list(_ndjson(text(b'{"name": \n')))
+        assert number == 1
+        assert error.startswith('invalid json')
+
+
+class TestCsv:
+    def test_rows_with_their_line(self):
+        records = list(_csv(text(b'name,description,iids\na,b,1;2\n"c\nd",e,\n')))
+        assert records == [(2, {'name': 'a', 'description': 'b', 'iids': '1;2'}),
+                           (4, {'name': 'c\nd', 'description': 'e', 'iids': ''})]
+
+    def test_malformed_row_is_reported_and_skipped(self):
+        limit = csv.field_size_limit()
+        csv.field_size_limit(50)
+        try:
+            records = list(_csv(text(b'name,description\na,b\n"' + b'x' * 100 + b'",c\nd,e\n')))
+        finally:
+            csv.field_size_limit(limit)
+
+        assert records[0] == (2, {'name': 'a', 'description': 'b'})
+        assert records[1][0] == 3
+        assert records[1][1].startswith('invalid csv')
+        assert records[2] == (4, {'name': 'd', 'description': 'e'})
+
+
+class TestNextChunk:
+    def test_chunks_of_size(self):
+        records = _ndjson(text(b''.join(b'{"name": "r%d", "description": ""}\n' % i for i in range(5))))
+        assert [len(_next_chunk(records, 2)) for _ in range(4)] == [2, 2, 1, 0]
+
+    def test_records_are_validated(self):
+        records = _csv(text(b'name,description,video_link,rtype,author,iids\n'
+                            b'a,b,,,,1;2\n'
+                            b'c,d,,x,,\n'))
+        [(first, record), (second, error)] = _next_chunk(records, 10)
+
+        assert first == 2
+        assert isinstance(record, RecipeImportRecord)
+        assert (record.rtype, record.author, record.iids) == (None, None, [1, 2])
+        assert second == 3
+        assert error.startswith('rtype')
+
+    def test_parse_errors_are_passed_on(self):
+        assert _next_chunk(iter([(4, 'invalid json: x')]), 10) == [(4, 'invalid json: x')]
+
+    @pytest.mark.parametrize('data', [b'\xff\xfe{"name": "a"}\n', b'{"name": "a", "description": ""}\n\xff\n'])
+    def test_not_utf8_ends_the_import(self, data):
+        chunk = _next_chunk(_ndjson(text(data)), 10)
+        assert chunk[-1] is None
+        assert chunk[-2][1] == 'the file is not utf-8, the rest of it is skipped'
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from search import KeywordIndex, RecipeDocument
+
+
+def keyword_index(documents: list[RecipeDocument]) -> KeywordIndex:
+    index = KeywordIndex()
+    for document in documents:
+        index._add(document)
+    index._loaded_version = index.version  # loaded, the database is never read
+    index._loaded_at = time.monotonic()
+    return index
+
+
+def search(index: KeywordIndex, keyword: str, **kwargs):
+    return asyncio.run(index.search(None, keyword, **kwargs))
+
+
+class TestKeywordIndex:
+    @pytest.fixture
+    def index(self) -> KeywordIndex:
+        return keyword_index([
+            RecipeDocument(1, '番茄炒蛋', '家常菜', '熱炒', ('alice',), 2),
+            RecipeDocument(2, '番茄', '湯', '湯品', ('bob',), 1),
+            RecipeDocument(3, '蛋花湯', '番茄口味', '湯品', ('carol',), 3),
+            RecipeDocument(4, 'Toast', 'egg', '番茄', ('Tomato Fan',), 5),
+            RecipeDocument(5, '炒飯', '蛋', '熱炒', ('dave',), 2),
+        ])
+
+    def test_rank(self, index):
+        # exact type, then exact title, then partial title, then fewer ingredients
+        assert search(index, '番茄')[0] == [4, 2, 1, 3]
+
+    def test_case_insensitive(self, index):
+        assert search(index, 'tomato')[0] == [4]
+        assert search(index, 'EGG')[0] == [4]
+
+    def test_single_character(self, index):
+        assert search(index, '蛋')[0] == [1, 3, 5]
+
+    def test_no_match(self, index):
+        assert search(index, '牛肉') == ([], None)
+
+    def test_remove(self, index):
+        asyncio.run(index.remove(2))
+        assert search(index, '番茄')[0] == [4, 1, 3]
@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import time
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from pagination import encode_cursor, decode_cursor
+from search import IndexSnapshot, KeywordIndex, RecipeDocument
+
+
+def pages(search, limit: int) -> list[int]:
+    # walk every page with the cursor of the previous one
+    rids, after = [], None
+    while True:
+        page, after = search(limit, after)
+        rids.extend(page)
+        if len(page) < limit:
+            return rids
+        after = decode_cursor(encode_cursor(after), *map(type, after))  # like a client sends it back
+
+
+class TestDecodeCursor:
+    def test_round_trip(self):
+        assert decode_cursor(encode_cursor([3.5, 2, 7]), float, int, int) == [3.5, 2, 7]
+        assert decode_cursor(encode_cursor([3, 2, 7]), float, int, int) == [3, 2, 7]  # a whole sum
+
+    @pytest.mark.parametrize('values', [
+        [1, 2],  # too short
+        [1.0, 2, 3, 4],  # too long
+        ['1', 2, 3],
+        [None, 2, 3],
+        [1.0, True, 3],
+        [1.0, 2.5, 3],  # float for an int
+    ])
+    def test_wrong_values(self, values):
+        with pytest.raises(HTTPException) as e:
+            decode_cursor(encode_cursor(values), float, int, int)
+        assert e.value.status_code == 400
+
+    @pytest.mark.parametrize('raw', [b'{"a": 1}', b'not json', b'[NaN, 1, 1]', b'[Infinity, 1, 1]', b'\xff\xfe'])
+    def test_malformed(self, raw):
+        with pytest.raises(HTTPException) as e:
+            decode_cursor(base64.urlsafe_b64encode(raw).decode().rstrip('='), float, int, int)
+        assert e.value.status_code == 400
+
+    def test_not_base64(self):
+        with pytest.raises(HTTPException):
+            decode_cursor('%%%', int)
+
+
+def test_ingredient_search_cursor_continues_the_ranking():
+    rng = np.random.default_rng(0)
+    index = IndexSnapshot(version=0, postings={
+        iid: (rng.choice(200, 80, replace=False).astype(np.int64), rng.integers(1, 4, 80).astype(np.float64),
+              rng.integers(1, 3, 80).astype(np.int64))
+        for iid in range(5)
+    })
+    everything = index.search(range(5), limit=1000)[0]
+    assert len(everything) > 100
+    for limit in (1, 7, 50):
+        assert pages(lambda n, after: index.search(range(5), limit=n, after=after), limit) == everything
+
+
+def test_keyword_search_cursor_continues_the_ranking():
+    index = KeywordIndex()
+    for rid in range(1, 40):
+        index._add(RecipeDocument(rid, f"番茄{rid % 3 * '蛋'}", '', ['番茄', '湯品'][rid % 2], (f"user{rid % 4}",),
+                                  rid % 5))
+    index._loaded_version = index.version  # loaded, the database is never read
+    index._loaded_at = time.monotonic()
+
+    def search(limit, after):
+        return asyncio.run(index.search(None, '番茄', limit=limit, after=after))
+
+    everything = search(1000, None)[0]
+    assert sorted(everything) == list(range(1, 40))
+    for limit in (1, 4, 10):
+        assert pages(search, limit) == everything
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from inference.postprocess import class_thresholds, filter_detections, group_by_class, confident_classes
+
+names = {0: 'beef', 1: 'carrot', 2: 'tofu'}
+thresholds = {'beef': 0.4, 'carrot': 0.5, 'common': 0.65}
+
+
+class TestClassThresholds:
+    def test_per_name_with_common_fallback(self):
+        assert class_thresholds(names, thresholds).tolist() == pytest.approx([0.4, 0.5, 0.65])
+
+    def test_default(self):
+        assert class_thresholds(names, default=0.3).tolist() == pytest.approx([0.3, 0.3, 0.3])
+
+    def test_built_once_per_names(self):
+        assert class_thresholds(names, thresholds) is class_thresholds(names, thresholds)
+        assert class_thresholds(dict(names), thresholds) is not class_thresholds(names, thresholds)
+
+
+class TestGroupByClass:
+    vector = class_thresholds(names, thresholds)
+
+    def test_groups_in_original_order(self):
+        xyxy = np.array([[0, 0, 1, 1], [1, 1, 2, 2], [2, 2, 3, 3], [3, 3, 4, 4]], dtype=np.float32)
+        result = group_by_class(xyxy, np.array([0.9, 0.9, 0.6, 0.9]), np.array([1, 0, 1, 1]), self.vector, names)
+        assert result == {'beef': [[1, 1, 2, 2]], 'carrot': [[0, 0, 1, 1], [2, 2, 3, 3], [3, 3, 4, 4]]}
+
+    def test_threshold_of_the_class(self):
+        xyxy = np.zeros((3, 4), dtype=np.float32)
+        # 0.45 clears beef (0.4) but not carrot (0.5), tofu falls back to common (0.65)
+        result = group_by_class(xyxy, np.array([0.45, 0.45, 0.6]), np.array([0, 1, 2]), self.vector, names)
+        assert list(result) == ['beef']
+
+    def test_nothing(self):
+        assert group_by_class(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=int), self.vector, names) == {}
+
+    def test_filter_keeps_the_arrays_aligned(self):
+        xyxy = np.arange(12, dtype=float).reshape(3, 4)
+        kept, conf, cls = filter_detections(xyxy, np.array([0.9, 0.1, 0.7]), np.array([2, 0, 2]), self.vector)
+        assert kept.tolist() == [xyxy[0].tolist(), xyxy[2].tolist()]
+        assert conf.tolist() == [0.9, 0.7]
+        assert cls.tolist() == [2, 2]
+
+
+class TestConfidentClasses:
+    vector = class_thresholds(names, thresholds)
+
+    def test_confident(self):
+        # under the floor is noise, it doesn't make the image uncertain
+        assert confident_classes(np.array([0.9, 0.8, 0.1]), np.array([0, 0, 1]), self.vector, 0.25) == ([0], False)
+
+    def test_between_floor_and_threshold_is_uncertain(self):
+        assert confident_classes(np.array([0.9, 0.3]), np.array([0, 1]), self.vector, 0.25) == ([0], True)
+
+    def test_nothing_confident_is_uncertain(self):
+        assert confident_classes(np.array([0.1]), np.array([2]), self.vector, 0.25) == ([], True)
+        assert confident_classes(np.zeros(0), np.zeros(0, dtype=int), self.vector, 0.25) == ([], True)
+
+    def test_classes_once_and_sorted(self):
+        classes, _ = confident_classes(np.array([0.9, 0.9, 0.9]), np.array([2, 0, 2]), self.vector, 0.25)
+        assert classes == [0, 2]
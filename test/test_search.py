@@ -0,0 +1,36 @@
+import numpy as np
+
+from search import IndexSnapshot
+
+
+def snapshot(postings: dict[int, list[tuple[int, float, int]]]) -> IndexSnapshot:
+    return IndexSnapshot(version=0, postings={
+        iid: (np.array([p[0] for p in entries], dtype=np.int64),
+              np.array([p[1] for p in entries], dtype=np.float64),
+              np.array([p[2] for p in entries], dtype=np.int64))
+        for iid, entries in postings.items()
+    })
+
+
+class TestIndexSnapshot:
+    index = snapshot({
+        1: [(10, 1.0, 1), (11, 2.0, 1), (12, 1.0, 2), (13, 1.0, 1)],
+        2: [(10, 1.0, 1), (14, 2.0, 2), (15, 0.0, 1)],
+    })
+
+    def test_order(self):
+        # SUM(weight) desc, then COUNT desc, then rid
+        rids, last = self.index.search([1, 2])
+        assert rids == [10, 14, 11, 12, 13]
+        assert last == (1.0, 1, 13)
+
+    def test_unknown_and_repeated_ingredients(self):
+        assert self.index.search([1, 1, 99]) == self.index.search([1])
+        assert self.index.search([99]) == ([], None)
+
+    def test_zero_weight_is_not_found(self):
+        assert 15 not in self.index.search([2])[0]
+
+    def test_offset(self):
+        assert self.index.search([1, 2], offset=2, limit=2)[0] == [11, 12]
+        assert self.index.search([1, 2], offset=5) == ([], None)
@@ -0,0 +1,143 @@
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from inference.slicing import Prediction, slice_boxes, merge, sliced_prediction, decode_image
+
+
+def prediction(*detections) -> Prediction:
+    # detections: (x1, y1, x2, y2, conf, cls)
+    values = np.array(detections, dtype=float).reshape(-1, 6)
+    return Prediction(values[:, :4].astype(np.float32), values[:, 4].astype(np.float32), values[:, 5].astype(int))
+
+
+class TestSliceBoxes:
+    def test_small_image_is_one_slice(self):
+        assert slice_boxes(300, 200, size=500).tolist() == [[0, 0, 300, 200]]
+
+    @pytest.mark.parametrize('width, height', [(1000, 700), (1280, 1280), (4032, 3024), (501, 500)])
+    def test_grid_covers_the_image(self, width, height):
+        slices = slice_boxes(width, height, size=500, overlap=0.2)
+        covered = np.zeros((height, width), dtype=bool)
+        for x1, y1, x2, y2 in slices:
+            assert (x2 - x1, y2 - y1) == (500, 500)  # the edge slices are moved back inside
+            assert 0 <= x1 and 0 <= y1 and x2 <= width and y2 <= height
+            covered[y1:y2, x1:x2] = True
+        assert covered.all()
+
+    def test_overlap(self):
+        assert slice_boxes(1000, 500, size=500, overlap=0.2)[:, 0].tolist() == [0, 400, 500]
+
+
+class TestMerge:
+    def test_overlapping_boxes_of_a_class_become_their_union(self):
+        merged = merge(prediction((0, 0, 10, 10, 0.6, 0), (2, 0, 12, 10, 0.9, 0)))
+        assert merged.boxes.tolist() == [[0, 0, 12, 10]]
+        assert merged.conf.tolist() == pytest.approx([0.9])
+        assert merged.cls.tolist() == [0]
+
+    def test_other_class_is_kept(self):
+        merged = merge(prediction((0, 0, 10, 10, 0.6, 0), (0, 0, 10, 10, 0.9, 1)))
+        assert sorted(merged.cls.tolist()) == [0, 1]
+
+    def test_small_overlap_is_kept(self):
+        merged = merge(prediction((0, 0, 10, 10, 0.6, 0), (8, 0, 18, 10, 0.9, 0)))
+        assert len(merged.boxes) == 2
+
+    def test_box_inside_a_larger_one(self):
+        # intersection over the smaller box, a slice's half of an object is absorbed
+        merged = merge(prediction((0, 0, 100, 100, 0.8, 0), (10, 10, 30, 30, 0.5, 0)))
+        assert merged.boxes.tolist() == [[0, 0, 100, 100]]
+
+    def test_empty(self):
+        assert len(merge(prediction()).boxes) == 0
+
+
+class FakeModel:
+    """
+    Finds one object of class 0 at the top left corner of every crop, remembers the crop sizes.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, crops, **kwargs):
+        self.calls.append([crop.shape[:2] for crop in crops])
+        return [SimpleNamespace(boxes=SimpleNamespace(xyxy=_Tensor([[0, 0, 5, 5]]), conf=_Tensor([0.8]),
+                                                      cls=_Tensor([0])))
+                for _ in crops]
+
+
+class _Tensor:
+    def __init__(self, values):
+        self.values = np.array(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class TestSlicedPrediction:
+    def test_small_image_gets_one_pass(self):
+        model = FakeModel()
+        [result] = sliced_prediction(model, [np.zeros((400, 600, 3), dtype=np.uint8)], 'cpu', coarse=False)
+        assert model.calls == [[(400, 600)]]
+        assert result.boxes.tolist() == [[0, 0, 5, 5]]
+
+    def test_slices_are_shifted_back_and_batched(self):
+        model = FakeModel()
+        image = np.zeros((1500, 1500, 3), dtype=np.uint8)
+        [result] = sliced_prediction(model, [image], 'cpu', coarse=False, batch_size=4)
+
+        crops = 1 + len(slice_boxes(1500, 1500))
+        assert [len(call) for call in model.calls] == [4] * (crops // 4) + ([crops % 4] if crops % 4 else [])
+        # one box per slice corner, in image coordinates
+        corners = {(x1, y1) for x1, y1, _, _ in slice_boxes(1500, 1500).tolist()}
+        assert {(x1, y1) for x1, y1, _, _ in result.boxes.tolist()} == corners
+
+    def test_one_result_per_image(self):
+        model = FakeModel()
+        images = [np.zeros((100, 100, 3), dtype=np.uint8), np.zeros((1400, 900, 3), dtype=np.uint8)]
+        results = sliced_prediction(model, images, 'cpu', coarse=False)
+        assert len(results) == 2
+        assert len(results[0].boxes) == 1
+
+    def test_coarse_pass_only_slices_around_candidates(self):
+        model = FakeModel()
+        sliced_prediction(model, [np.zeros((1500, 1500, 3), dtype=np.uint8)], 'cpu', coarse=True)
+        # the full frame finds the top left corner, only the slice holding it is run
+        assert model.calls == [[(1500, 1500)], [(500, 500)]]
+
+
+def encode(image: Image.Image, fmt: str = 'PNG', **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+class TestDecodeImage:
+    @pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'LA', 'L', 'P'])
+    def test_every_mode_is_three_channels(self, mode):
+        image = decode_image(encode(Image.new(mode, (40, 30))))
+        assert image.shape == (30, 40, 3)
+        assert image.flags['C_CONTIGUOUS']
+
+    def test_bgr(self):
+        assert decode_image(encode(Image.new('RGB', (2, 2), (255, 0, 0))))[0, 0].tolist() == [0, 0, 255]
+
+    def test_exif_orientation(self):
+        image = Image.new('RGB', (40, 30))
+        exif = image.getexif()
+        exif[0x0112] = 6  # stored sideways, shown rotated by 90 degrees
+        assert decode_image(encode(image, 'JPEG', exif=exif)).shape == (40, 30, 3)
+
+    def test_not_an_image(self):
+        with pytest.raises(HTTPException) as e:
+            decode_image(b'not an image')
+        assert e.value.status_code == 415
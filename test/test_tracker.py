@@ -0,0 +1,81 @@
+import numpy as np
+
+from inference.tracker import IoUTracker, match
+
+
+def boxes(*values) -> np.ndarray:
+    return np.array(values, dtype=float).reshape(-1, 4)
+
+
+class TestMatch:
+    def test_empty(self):
+        assert match(boxes(), boxes((0, 0, 10, 10))) == []
+        assert match(boxes((0, 0, 10, 10)), boxes()) == []
+
+    def test_best_overlap_first(self):
+        tracks = boxes((0, 0, 10, 10), (1, 1, 11, 11))
+        detections = boxes((1, 1, 11, 11), (0, 0, 10, 10))
+        assert sorted(match(tracks, detections)) == [(0, 1), (1, 0)]
+
+    def test_one_to_one(self):
+        # both detections overlap the only track, the better one gets it
+        assert match(boxes((0, 0, 10, 10)), boxes((2, 2, 12, 12), (0, 0, 10, 9))) == [(0, 1)]
+
+    def test_centroid_when_the_boxes_barely_overlap(self):
+        # IoU 0.16, but the same center: a shrinking box still continues the track
+        assert match(boxes((0, 0, 10, 10)), boxes((3, 3, 7, 7))) == [(0, 0)]
+
+    def test_too_far(self):
+        assert match(boxes((0, 0, 10, 10)), boxes((20, 20, 30, 30))) == []
+
+
+class TestIoUTracker:
+    frame = np.zeros((2, 2, 3), dtype=np.uint8)
+
+    def update(self, tracker, index, detections):
+        # detections: [(cls, box, conf)]
+        return tracker.update(index, boxes(*[box for _, box, _ in detections]),
+                              np.array([conf for _, _, conf in detections], dtype=float),
+                              np.array([cls for cls, _, _ in detections], dtype=int), self.frame)
+
+    def test_track_continues_and_keeps_the_best_detection(self):
+        tracker = IoUTracker(max_gap=2)
+        for index, conf in enumerate([0.5, 0.9, 0.7]):
+            assert self.update(tracker, index, [(0, (index, 0, index + 10, 10), conf)]) == []
+
+        [track] = tracker.close()
+        assert (track.first, track.last, track.hits) == (0, 2, 3)
+        assert track.best_conf == 0.9
+        assert track.best_box.tolist() == [1, 0, 11, 10]
+        assert track.first_box.tolist() == [0, 0, 10, 10]
+
+    def test_closed_after_the_gap(self):
+        tracker = IoUTracker(max_gap=2)
+        self.update(tracker, 0, [(0, (0, 0, 10, 10), 0.5)])
+        assert self.update(tracker, 1, []) == []
+        assert self.update(tracker, 2, []) == []
+        [track] = self.update(tracker, 3, [])
+        assert (track.first, track.last) == (0, 0)
+        assert tracker.tracks == []
+
+    def test_detection_within_the_gap_continues(self):
+        tracker = IoUTracker(max_gap=2)
+        self.update(tracker, 0, [(0, (0, 0, 10, 10), 0.5)])
+        self.update(tracker, 1, [])
+        self.update(tracker, 2, [])
+        assert self.update(tracker, 3, [(0, (0, 0, 10, 10), 0.5)]) == []
+        [track] = tracker.close()
+        assert (track.last, track.hits, track.missed) == (3, 2, 0)
+
+    def test_classes_are_tracked_apart(self):
+        tracker = IoUTracker()
+        self.update(tracker, 0, [(0, (0, 0, 10, 10), 0.5)])
+        self.update(tracker, 1, [(1, (0, 0, 10, 10), 0.5)])
+        assert sorted((t.cls, t.hits) for t in tracker.close()) == [(0, 1), (1, 1)]
+
+    def test_best_frame_is_a_copy(self):
+        tracker = IoUTracker()
+        frame = np.zeros((2, 2, 3), dtype=np.uint8)
+        tracker.update(0, boxes((0, 0, 10, 10)), np.array([0.5]), np.array([0]), frame)
+        frame[:] = 255  # the buffer is reused by the decoder
+        assert tracker.close()[0].best_frame.max() == 0
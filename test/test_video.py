@@ -0,0 +1,112 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('inference.video')  # needs opencv, ffmpeg and ultralytics
+
+from inference.sampling import streak_threshold  # noqa: E402
+from inference.tracker import VIDEO_TRACK_GAP  # noqa: E402
+from inference.video import VIDEO_FPS, limit, merge_segment_results, SegmentTracker  # noqa: E402
+
+
+class TestMergeSegmentResults:
+    @pytest.fixture
+    def snapshots(self, tmp_path):
+        def make(name: str) -> str:
+            path = tmp_path / f"{name}.jpg"
+            path.write_bytes(b'')
+            return str(path)
+        return make
+
+    def record(self, path, name, first, last, hits, conf=0.5, box=(0, 0, 10, 10), open_start=False, open_end=False):
+        return dict(name=name, first=first, last=last, first_box=list(box), last_box=list(box), hits=hits, conf=conf,
+                    path=path, open_start=open_start, open_end=open_end)
+
+    def test_joins_tracks_across_segments(self, snapshots):
+        hits = streak_threshold(VIDEO_FPS, 2, limit)
+        a, b = snapshots('a'), snapshots('b')
+        result = merge_segment_results([
+            [self.record(a, 'egg', 0, 10, hits, conf=0.4, open_end=True)],
+            [self.record(b, 'egg', 11, 20, 1, conf=0.9, open_start=True)],
+        ], stride=2)
+
+        # neither part is long enough alone, together they are, the better snapshot is kept
+        assert result == {'egg': [b]}
+        assert not os.path.exists(a)
+
+    def test_gap_too_long_is_not_joined(self, snapshots):
+        hits = streak_threshold(VIDEO_FPS, 2, limit) + 1
+        a, b = snapshots('a'), snapshots('b')
+        result = merge_segment_results([
+            [self.record(a, 'egg', 0, 10, hits, open_end=True)],
+            [self.record(b, 'egg', 12 + VIDEO_TRACK_GAP, 20, hits, open_start=True)],
+        ], stride=2)
+
+        # missed for one frame more than a single pass allows, so two objects
+        assert result == {'egg': [a, b]}
+
+    def test_drops_short_tracks_and_orders_by_time(self, snapshots):
+        hits = streak_threshold(VIDEO_FPS, 2, limit) + 1
+        late, early, short = snapshots('late'), snapshots('early'), snapshots('short')
+        result = merge_segment_results([
+            [self.record(short, 'egg', 0, 1, 1)],
+            [self.record(late, 'egg', 30, 40, hits), self.record(early, 'egg', 25, 28, hits, box=(50, 50, 60, 60))],
+        ], stride=2)
+
+        assert result == {'egg': [early, late]}
+        assert not os.path.exists(short)
+
+    def test_other_ingredient_is_not_joined(self, snapshots):
+        hits = streak_threshold(VIDEO_FPS, 2, limit) + 1
+        egg, tomato = snapshots('egg'), snapshots('tomato')
+        result = merge_segment_results([
+            [self.record(egg, 'egg', 0, 10, hits, open_end=True)],
+            [self.record(tomato, 'tomato', 11, 20, hits, open_start=True)],
+        ], stride=2)
+
+        assert result == {'egg': [egg], 'tomato': [tomato]}
+
+
+class TestSegmentsMatchSinglePass:
+    names = {0: 'egg', 1: 'tomato', 2: 'onion'}
+    frames = 70
+    # cls, box, frames the object is detected in
+    objects = [
+        (0, (0, 0, 10, 10), [i for i in range(60) if not 27 - VIDEO_TRACK_GAP <= i < 27]),  # short gap at 25
+        (1, (50, 50, 60, 60), [*range(10, 20), *range(20 + VIDEO_TRACK_GAP + 2, 35)]),  # long gap over 25
+        (2, (20, 20, 30, 30), [30, 31]),  # flicker
+        (0, (100, 100, 110, 110), list(range(45, 56))),  # across 50
+    ]
+
+    def detections(self, index: int):
+        found = [(cls, box, 0.5 + 0.4 * math.sin(index * (n + 1))) for n, (cls, box, seen) in enumerate(self.objects)
+                 if index in seen]
+        return (np.array([box for _, box, _ in found], dtype=float).reshape(-1, 4),
+                np.array([conf for _, _, conf in found]), np.array([cls for cls, _, _ in found], dtype=int))
+
+    def run(self, boundaries: list[int]) -> dict[str, list[int]]:
+        # returns the frame of every snapshot instead of its (random) path
+        min_hits = streak_threshold(VIDEO_FPS, 2, limit) + 1
+        frame_of, segments = {}, []
+        edges = boundaries + [self.frames]
+        for k, (start, end) in enumerate(zip(edges, edges[1:])):
+            tracks = SegmentTracker(self.names, min_hits, start, k > 0)
+            closed = []
+            for index in range(start, end):
+                closed += tracks.update(index, self.detections(index), np.array(index))
+            closed += tracks.close(k < len(boundaries) - 1)
+            frame_of.update((record['path'], int(track.best_frame)) for track, record in closed)
+            segments.append([record for _, record in closed])
+
+        result = merge_segment_results(segments, stride=2)
+        return {name: [frame_of[path] for path in paths] for name, paths in result.items()}
+
+    def test_same_result(self):
+        single = self.run([0])
+        assert len(single['tomato']) == 2  # the long gap splits the track
+        assert len(single['egg']) == 2
+        assert 'onion' not in single
+        assert self.run([0, 25, 50]) == single
+        assert self.run([0, 20, 40, 60]) == single